@@ -1,6 +1,8 @@
 #
 # Copyright 2008 Optaros, Inc.
 #
+import atexit
+
 from django.conf import settings
 from django.db.models import signals
 from django.db.models.base import ModelBase
@@ -9,9 +11,10 @@ registry = {}
 
 #Fields so we can do run things like solango.CharField
 from solango.solr import fields
-from solango.solr import get_model_key
+from solango.solr import get_model_key, get_document_id
 from solango.solr.connection import SearchWrapper
 from solango.solr.documents import SearchDocument
+from solango.solr.writer import BufferedWriter
 
 class AlreadyRegistered(Exception):
     pass
@@ -21,6 +24,14 @@ class NotRegistered(Exception):
 
 connection = SearchWrapper()
 SearchDocument = SearchDocument
+
+#Collects signal driven updates when SEARCH_BUFFERED_INDEXING is on
+indexer = BufferedWriter(connection, getattr(settings, 'SEARCH_BUFFER_SIZE', 500))
+#The interval commit timer is a daemon thread, run a pending commit at exit
+atexit.register(connection.flush_commit)
+#Saves made outside a request (shell, management commands) are sent at exit,
+#before the commit above as atexit runs them last in, first out
+atexit.register(indexer.flush)
         
 def post_save(sender, instance, created, *args, **kwargs):
     """
@@ -35,7 +46,10 @@ def post_save(sender, instance, created, *args, **kwargs):
     
     document = registry[key](instance)
     #Note adding and updating a document in solr uses the same command
-    connection.add([document])
+    if getattr(settings, 'SEARCH_BUFFERED_INDEXING', False):
+        indexer.add(document)
+    else:
+        connection.add([document])
 
 def post_delete( sender, instance, *args, **kwargs):
     """
@@ -48,8 +62,12 @@ def post_delete( sender, instance, *args, **kwargs):
     if key not in registry.keys():
         return None
     
-    document = registry[key](instance)
-    connection.delete([document,]) 
+    #Only the id is needed, don't run the document transforms
+    id = get_document_id(key, instance.pk)
+    if getattr(settings, 'SEARCH_BUFFERED_INDEXING', False):
+        indexer.delete(id)
+    else:
+        connection.delete_by_id([id])
 
 def register(model_or_iterable, search_document=None):
     if isinstance(model_or_iterable, ModelBase):
@@ -0,0 +1,146 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Benchmarks for the hot paths of a search, run against synthetic data so
+neither Solr nor a database is needed.
+
+    $ DJANGO_SETTINGS_MODULE=mysite.settings python -m solango.benchmarks
+
+Each benchmark prints the best of a few runs, per call.
+"""
+import random
+import timeit
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.utils import simplejson
+
+import solango
+from solango.solr import results
+from solango.solr.facet import Facet
+
+def best_of(func, number=5, repeat=3):
+    """
+    Returns the best time of func, in milliseconds per call.
+    """
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1000
+
+def make_select(docs=1000, values=500):
+    """
+    Returns a select response as XML and JSON, with docs documents and a
+    facet field of values values.
+    """
+    xml = ['<?xml version="1.0" encoding="UTF-8"?><response>'
+           '<lst name="responseHeader"><int name="status">0</int><int name="QTime">1</int>'
+           '<lst name="params"><str name="q">*:*</str><str name="rows">%s</str><str name="start">0</str><str name="facet.field">category</str></lst></lst>'
+           '<result name="response" numFound="%s" start="0">' % (docs, docs)]
+    json_docs = []
+    for i in range(docs):
+        doc = {'id': 'blog__entry__%s' % i, 'model': 'blog__entry', 'site_id': 1,
+               'score': 1.0 / (i + 1), 'title': 'Entry %s' % i,
+               'text': ['Some text about entry %s' % i],
+               'pub_date': '2008-05-01T00:00:00Z'}
+        json_docs.append(doc)
+        xml.append('<doc><float name="score">%r</float><str name="id">%s</str>'
+                   '<str name="model">%s</str><int name="site_id">%s</int>'
+                   '<str name="title">%s</str><arr name="text"><str>%s</str></arr>'
+                   '<date name="pub_date">%s</date></doc>'
+                   % (doc['score'], doc['id'], doc['model'], doc['site_id'],
+                      escape(doc['title']), escape(doc['text'][0]), doc['pub_date']))
+    xml.append('</result><lst name="facet_counts"><lst name="facet_queries"/>'
+               '<lst name="facet_fields"><lst name="category">')
+    counts = [('category__%s' % i, values - i) for i in range(values)]
+    for (value, count) in counts:
+        xml.append('<int name="%s">%s</int>' % (value, count))
+    xml.append('</lst></lst></lst></response>')
+
+    json = simplejson.dumps({
+        'responseHeader': {'status': 0, 'QTime': 1,
+                           'params': {'q': '*:*', 'rows': str(docs), 'start': '0',
+                                      'facet.field': 'category'}},
+        'response': {'numFound': docs, 'start': 0, 'docs': json_docs},
+        'facet_counts': {'facet_queries': {},
+                         'facet_fields': {'category': [list(c) for c in counts]}},
+    })
+    return (''.join(xml), json)
+
+def bench_parsers(docs=1000, values=500):
+    """
+    Times parsing a select response with the DOM, JSON and streaming parsers.
+    """
+    (xml, json) = make_select(docs, values)
+    print "Parsing %s documents and %s facet values" % (docs, values)
+    print "  xml (dom):  %8.2f ms" % best_of(lambda: results.SelectResults(xml))
+    print "  json:       %8.2f ms" % best_of(lambda: results.JSONSelectResults(json))
+    print "  xml (sax):  %8.2f ms" % best_of(lambda: results.StreamingSelectResults(xml))
+
+class Options(object):
+    (app_label, module_name) = ('blog', 'entry')
+
+class Entry(object):
+    """
+    Stands in for a model instance, a document only reads its attributes.
+    """
+    (pk, _meta) = (1, Options())
+    (title, body, author) = ('Hello', 'Some text about the entry', 'joe')
+
+    def get_absolute_url(self):
+        return '/blog/%s/' % self.pk
+
+class EntryDocument(solango.SearchDocument):
+    title = solango.fields.CharField(copy=True)
+    body = solango.fields.TextField(copy=True)
+    author = solango.fields.CharField()
+
+    def transform_author(self, instance):
+        return instance.author.title()
+
+def bench_documents():
+    """
+    Times building a document from a model instance, as indexing does, and
+    from a Solr result, as a select does.
+    """
+    raw = {'id': u'blog__entry__1', 'model': u'blog__entry', 'site_id': u'1',
+           'url': u'/blog/1/', 'text': u'Hello', 'title': u'Hello',
+           'body': u'Some text about the entry', 'author': u'Joe'}
+    document = EntryDocument(raw)
+    document._model = Entry()
+
+    print "Building documents"
+    print "  transform:  %8.2f us" % (best_of(document.transform, number=10000) * 1000)
+    print "  clean:      %8.2f us" % (best_of(lambda: EntryDocument(raw), number=10000) * 1000)
+
+def make_category_counts(values, depth=4, width=30):
+    """
+    Returns values (value, count) pairs of random category paths, up to
+    depth levels deep, as a hierarchical facet field returns them.
+    """
+    rand = random.Random(1)
+    (counts, seen) = ([], set())
+    while len(counts) < values:
+        path = ['c%d' % rand.randint(0, width) for i in range(rand.randint(1, depth))]
+        value = settings.FACET_SEPARATOR.join(path)
+        if value not in seen:
+            seen.add(value)
+            counts.append((value, rand.randint(1, 100)))
+    return counts
+
+def bench_facets(sizes=(2000, 10000, 30000)):
+    """
+    Times merging hierarchical facet values into a tree.
+    """
+    print "Merging facet values"
+    for values in sizes:
+        counts = make_category_counts(values)
+        print "  %6d:     %8.2f ms" % (values, best_of(lambda: Facet.from_counts('category', counts),
+                                                         number=1))
+
+def main():
+    bench_parsers()
+    bench_documents()
+    bench_facets()
+
+if __name__ == '__main__':
+    main()
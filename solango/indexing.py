@@ -0,0 +1,538 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Rebuilds the Solr index from the registered models.
+
+reindex is pipelined: the calling thread fetches instances from the database
+and transforms them into documents, while a pool of sender threads posts the
+batches to Solr in parallel.
+
+reindex_sharded is for documents whose transforms are CPU bound.  The primary
+key range of each model is split into shards which are indexed by a pool of
+processes, each with its own database connection and SearchWrapper.  A shard
+that fails is retried on its own.
+
+Either way nothing is committed until every model has been sent, then a single
+commit makes the new documents visible.
+
+Models are walked in primary key order with keyset pagination
+(pk > last pk seen), one chunk at a time, so memory stays bounded whatever
+the size of the table.
+
+reindex_incremental only sends the objects whose Meta.timestamp_field changed
+since the last run.  A per-model checkpoint is persisted in
+SEARCH_CHECKPOINT_FILE after every committed batch, so an interrupted run
+resumes where it stopped.
+"""
+
+from datetime import date, datetime, timedelta, tzinfo
+import os
+import Queue
+import tempfile
+import threading
+import time
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from solango.log import logger
+
+class ReindexStats(object):
+    """
+    Progress of the reindex of a single model.
+
+    rss_growth -- KB the peak resident set size grew by while the model was
+        indexed, summed over the worker processes of a sharded reindex.  The
+        peak is a high-water mark for the life of the process, so a model
+        indexed after a bigger one shows no growth.
+    """
+    def __init__(self, model_key, total=None):
+        (self.model_key, self.total) = (model_key, total)
+        (self.sent, self.errors, self.batches) = (0, 0, 0)
+        (self.started, self.finished) = (time.time(), None)
+        (self._start_rss, self.rss_growth) = (get_peak_rss(), None)
+        self._lock = threading.Lock()
+
+    def record(self, sent=0, errors=0):
+        self._lock.acquire()
+        try:
+            self.sent += sent
+            self.errors += errors
+            self.batches += 1
+        finally:
+            self._lock.release()
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def rate(self):
+        """
+        Documents sent per second.
+        """
+        if not self.elapsed:
+            return 0.0
+        return self.sent / self.elapsed
+
+    def add_rss_growth(self, growth):
+        if growth is not None:
+            self.rss_growth = (self.rss_growth or 0) + growth
+
+    def finish(self):
+        """
+        Marks the model as done, recording how much this process's peak
+        resident set size grew since the model was started.
+        """
+        self.finished = time.time()
+        if self._start_rss is not None:
+            self.add_rss_growth(get_peak_rss() - self._start_rss)
+
+    def __unicode__(self):
+        done = self.sent + self.errors
+        if self.total is not None:
+            done = "%d/%d" % (done, self.total)
+        ret = u"%s: %s documents in %.1fs (%.1f docs/s), %d errors" % \
+            (self.model_key, done, self.elapsed, self.rate, self.errors)
+        if self.rss_growth is not None:
+            ret += u", peak RSS +%d KB" % self.rss_growth
+        return ret
+
+def get_peak_rss():
+    """
+    Returns the peak resident set size of this process in KB, or None where
+    the resource module is not available.
+    """
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+class Sender(threading.Thread):
+    """
+    Posts batches of documents from the queue to Solr, without committing.
+    """
+    def __init__(self, connection, queue, progress=None, report_every=10):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        (self.connection, self.queue) = (connection, queue)
+        (self.progress, self.report_every) = (progress, report_every)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                (stats, batch) = item
+                self.send(stats, batch)
+            finally:
+                self.queue.task_done()
+
+    def send(self, stats, batch):
+        try:
+            res = self.connection.add(batch, commit=False)
+        except StandardError, e:
+            logger.error("reindex %s: %s" % (stats.model_key, e))
+            res = None
+
+        if res:
+            stats.record(sent=len(batch))
+        else:
+            stats.record(errors=len(batch))
+
+        if self.progress and not stats.batches % self.report_every:
+            self.progress(stats)
+
+def iter_chunks(queryset, chunk_size):
+    """
+    Yields the instances of queryset in primary key order, as lists of at most
+    chunk_size.  Each chunk is a separate query starting after the last
+    primary key of the previous one, so the queryset is never cached as a
+    whole.  With DEBUG on the logged queries are dropped after every chunk.
+    """
+    from django.conf import settings
+    from django.db import reset_queries
+
+    (queryset, last) = (queryset.order_by('pk'), None)
+
+    while True:
+        chunk = queryset
+        if last is not None:
+            chunk = chunk.filter(pk__gt=last)
+        chunk = list(chunk[:chunk_size])
+
+        if settings.DEBUG:
+            reset_queries()
+        if not chunk:
+            return
+
+        last = chunk[-1].pk
+        yield chunk
+
+        if len(chunk) < chunk_size:
+            return
+
+def iter_batches(queryset, document, batch_size):
+    """
+    Yields lists of at most batch_size documents for every instance in
+    queryset.
+    """
+    for chunk in iter_chunks(queryset, batch_size):
+        yield [document(instance) for instance in chunk]
+
+def reindex(workers=1, batch_size=100, progress=None):
+    """
+    Reindexes all of the models registered to solango.
+
+    workers    -- Number of threads posting batches to Solr
+    batch_size -- Number of documents per <add>
+    progress   -- Called with the ReindexStats of a model every few batches
+                  and once the model is done
+
+    Returns the list of ReindexStats, one per model.
+    """
+    import solango
+    from solango.solr import get_model_from_key
+
+    queue = Queue.Queue(workers * 2)
+    senders = [Sender(solango.connection, queue, progress) for i in range(workers)]
+    for sender in senders:
+        sender.start()
+
+    report = []
+    try:
+        for model_key, document in solango.registry.items():
+            model = get_model_from_key(model_key)
+            stats = ReindexStats(model_key, model.objects.count())
+
+            for batch in iter_batches(model.objects.all(), document, batch_size):
+                queue.put((stats, batch))
+
+            # Let the senders drain the queue so the numbers are per model
+            queue.join()
+            stats.finish()
+            report.append(stats)
+            if progress:
+                progress(stats)
+    finally:
+        for sender in senders:
+            queue.put(None)
+        for sender in senders:
+            sender.join()
+
+    solango.connection.commit()
+    return report
+
+def get_shards(model, count):
+    """
+    Splits the primary key range of model into at most count inclusive
+    (low, high) ranges.  Models without an integer primary key get a single
+    (None, None) shard covering every row.
+    """
+    from django.db.models import Min, Max
+
+    pk = model._meta.pk.name
+    bounds = model.objects.aggregate(low=Min(pk), high=Max(pk))
+    (low, high) = (bounds['low'], bounds['high'])
+
+    if low is None:
+        return []
+    if not isinstance(low, (int, long)):
+        return [(None, None)]
+
+    # Round up, a remainder must not add a shard beyond count
+    size = max((high - low + count) / count, 1)
+    return [(start, min(start + size - 1, high)) for start in range(low, high + 1, size)]
+
+_worker_connection = None
+
+def _init_worker():
+    """
+    Runs once in every reindex process.  The database connection inherited
+    from the parent must not be shared, so it is closed and reopened lazily.
+    """
+    global _worker_connection
+    from django.db import connection
+    from solango.solr.connection import SearchWrapper
+
+    connection.close()
+    _worker_connection = SearchWrapper()
+
+def index_shard(shard):
+    """
+    Indexes the rows of a single shard, (model_key, low, high, batch_size).
+    Returns (shard, sent, errors, message, rss_growth, span), rss_growth being
+    how much the worker's peak RSS grew during the shard and span its
+    (started, finished) times; exceptions are reported rather than raised so
+    the parent can retry the shard.
+    """
+    import solango
+    from solango.solr import get_model_from_key
+
+    (model_key, low, high, batch_size) = shard
+    (sent, errors) = (0, 0)
+    (start_rss, started) = (get_peak_rss(), time.time())
+
+    try:
+        model = get_model_from_key(model_key)
+        queryset = model.objects.all()
+        if low is not None:
+            queryset = queryset.filter(pk__gte=low, pk__lte=high)
+
+        for batch in iter_batches(queryset, solango.registry[model_key], batch_size):
+            if _worker_connection.add(batch, commit=False):
+                sent += len(batch)
+            else:
+                errors += len(batch)
+    except Exception, e:
+        return (shard, sent, errors, "%s: %s" % (e.__class__.__name__, e),
+                get_rss_growth(start_rss), (started, time.time()))
+
+    return (shard, sent, errors, None, get_rss_growth(start_rss), (started, time.time()))
+
+def get_rss_growth(start_rss):
+    """
+    Returns how many KB the peak RSS of this process grew since start_rss.
+    """
+    if start_rss is None:
+        return None
+    return get_peak_rss() - start_rss
+
+def reindex_sharded(processes=2, batch_size=100, retries=2, progress=None):
+    """
+    Reindexes all of the models registered to solango using a pool of
+    processes.
+
+    processes  -- Number of worker processes
+    batch_size -- Number of documents per <add>
+    retries    -- How many times a failed shard is retried
+    progress   -- Called with the ReindexStats of a model after each shard
+
+    Returns the list of ReindexStats, one per model.
+    """
+    import solango
+    from solango.solr import get_model_from_key
+
+    if multiprocessing is None:
+        raise ImportError("reindex_sharded requires the multiprocessing module")
+
+    # Shards of every model run interleaved, a model's time is the span from
+    # its first shard starting to its last one finishing
+    (shards, report, spans) = ([], {}, {})
+    for model_key in solango.registry.keys():
+        model = get_model_from_key(model_key)
+        report[model_key] = ReindexStats(model_key, model.objects.count())
+        for (low, high) in get_shards(model, processes * 4):
+            shards.append((model_key, low, high, batch_size))
+
+    # Don't hand the parent's database connection to the children.
+    from django.db import connection
+    connection.close()
+
+    pool = multiprocessing.Pool(processes, _init_worker)
+    try:
+        attempt = 0
+        while shards:
+            failed = []
+            for (shard, sent, errors, message, growth, span) in pool.imap_unordered(index_shard, shards):
+                stats = report[shard[0]]
+                stats.add_rss_growth(growth)
+                (started, finished) = spans.get(shard[0], span)
+                spans[shard[0]] = (min(started, span[0]), max(finished, span[1]))
+                stats.started = spans[shard[0]][0]
+                if message or errors:
+                    logger.error("reindex %s shard %s-%s failed (attempt %d): %s" %
+                                 (shard[0], shard[1], shard[2], attempt + 1, message or "%d errors" % errors))
+                    failed.append(shard)
+                    if attempt < retries:
+                        continue
+                stats.record(sent, errors)
+                if progress:
+                    progress(stats)
+            attempt += 1
+            shards = attempt <= retries and failed or []
+    finally:
+        pool.close()
+        pool.join()
+
+    for stats in report.values():
+        # The work was done by the workers, their growth is already recorded
+        (stats.started, stats.finished) = spans.get(stats.model_key, (stats.started, time.time()))
+
+    solango.connection.commit()
+    return report.values()
+
+class CheckpointStore(object):
+    """
+    Persists the (timestamp, pk) of the last object indexed per model in a
+    JSON file.  Every update rewrites a temporary file and renames it over
+    the old one, so the file is never left half written.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.checkpoints = {}
+        if os.path.exists(path):
+            from django.utils import simplejson
+            f = open(path)
+            try:
+                self.checkpoints = simplejson.load(f)
+            finally:
+                f.close()
+
+    def get(self, model_key):
+        """
+        Returns the (timestamp, pk) checkpoint of model_key, or None.
+        """
+        checkpoint = self.checkpoints.get(model_key)
+        if not checkpoint:
+            return None
+        (value, pk) = checkpoint
+        return (parse_timestamp(value), pk)
+
+    def set(self, model_key, timestamp, pk):
+        from django.utils import simplejson
+
+        self.checkpoints[model_key] = [timestamp.isoformat(), pk]
+
+        (fd, tmp) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
+        f = os.fdopen(fd, 'w')
+        try:
+            simplejson.dump(self.checkpoints, f)
+        finally:
+            f.close()
+        os.rename(tmp, self.path)
+
+class FixedOffset(tzinfo):
+    """
+    A fixed UTC offset in minutes, for the timezone aware datetimes read by
+    parse_timestamp.
+    """
+    def __init__(self, minutes):
+        self.minutes = minutes
+
+    def utcoffset(self, dt):
+        return timedelta(minutes=self.minutes)
+
+    def dst(self, dt):
+        return timedelta(0)
+
+    def tzname(self, dt):
+        sign = self.minutes < 0 and "-" or "+"
+        return "%s%02d:%02d" % ((sign,) + divmod(abs(self.minutes), 60))
+
+def parse_timestamp(value):
+    """
+    Parses the isoformat() of a date or datetime back into the object,
+    including the UTC offset of a timezone aware datetime.
+    """
+    if "T" not in value:
+        return date(*time.strptime(value, "%Y-%m-%d")[0:3])
+
+    tz = None
+    if value[-6:-5] in ("+", "-"):
+        (value, offset) = (value[:-6], value[-6:])
+        minutes = int(offset[1:3]) * 60 + int(offset[4:6])
+        tz = FixedOffset(offset[0] == "-" and -minutes or minutes)
+
+    microsecond = 0
+    if "." in value:
+        (value, fraction) = value.split(".")
+        microsecond = int(fraction.ljust(6, "0"))
+    return datetime(*time.strptime(value, "%Y-%m-%dT%H:%M:%S")[0:6]).replace(
+        microsecond=microsecond, tzinfo=tz)
+
+def iter_changed_chunks(queryset, field, checkpoint, chunk_size):
+    """
+    Yields the instances of queryset changed after checkpoint, ordered by
+    (field, pk), as lists of at most chunk_size.  Keyset pagination on the
+    (field, pk) pair makes sure objects sharing a timestamp are neither
+    skipped nor sent twice.  Objects whose field is NULL have no place in
+    that order and are left out.
+    """
+    from django.conf import settings
+    from django.db import reset_queries
+    from django.db.models import Q
+
+    queryset = queryset.filter(**{'%s__isnull' % field: False}).order_by(field, 'pk')
+
+    while True:
+        chunk = queryset
+        if checkpoint:
+            (value, pk) = checkpoint
+            chunk = chunk.filter(Q(**{'%s__gt' % field: value}) | Q(**{field: value, 'pk__gt': pk}))
+        chunk = list(chunk[:chunk_size])
+
+        if settings.DEBUG:
+            reset_queries()
+        if not chunk:
+            return
+
+        yield chunk
+
+        if len(chunk) < chunk_size:
+            return
+        checkpoint = (getattr(chunk[-1], field), chunk[-1].pk)
+
+def reindex_incremental(batch_size=100, progress=None, path=None):
+    """
+    Sends the objects of every registered model with a Meta.timestamp_field
+    that changed since the model's checkpoint.  Each batch is committed
+    before its checkpoint is stored, so a checkpoint never runs ahead of
+    what Solr has made durable.  Deleted objects are not detected, and
+    objects whose timestamp_field is NULL are only sent by a full reindex.
+
+    Returns the list of ReindexStats, one per model.
+    """
+    import solango
+    from django.conf import settings
+    from solango.solr import get_model_from_key
+
+    path = path or getattr(settings, 'SEARCH_CHECKPOINT_FILE', None)
+    if not path:
+        raise ValueError("The incremental reindex needs SEARCH_CHECKPOINT_FILE")
+
+    (store, report) = (CheckpointStore(path), [])
+
+    for model_key, document in solango.registry.items():
+        field = document.timestamp_field
+        if not field:
+            logger.info("reindex_incremental: %s has no timestamp_field, skipped" % model_key)
+            continue
+
+        model = get_model_from_key(model_key)
+        stats = ReindexStats(model_key)
+
+        for chunk in iter_changed_chunks(model.objects.all(), field, store.get(model_key), batch_size):
+            try:
+                res = solango.connection.add([document(instance) for instance in chunk], commit=False)
+                if res:
+                    solango.connection.commit()
+            except StandardError, e:
+                logger.error("reindex_incremental %s: %s" % (model_key, e))
+                res = None
+
+            if not res:
+                # Leave the checkpoint alone, the next run picks up from here
+                stats.record(errors=len(chunk))
+                break
+
+            store.set(model_key, getattr(chunk[-1], field), chunk[-1].pk)
+            stats.record(sent=len(chunk))
+            if progress and not stats.batches % 10:
+                progress(stats)
+
+        stats.finish()
+        report.append(stats)
+        if progress:
+            progress(stats)
+
+    return report
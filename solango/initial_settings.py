@@ -7,11 +7,65 @@ SEARCH_UPDATE_URL = "http://localhost:8983/solr/update"
 SEARCH_SELECT_URL = "http://localhost:8983/solr/select"
 SEARCH_PING_URLS = ["http://localhost:8983/solr/admin/ping",]
 
+# Replicas to spread selects over (defaults to SEARCH_SELECT_URL). Updates always go
+# to SEARCH_UPDATE_URL. SEARCH_SELECT_POLICY is "round_robin" or "least_outstanding".
+# A replica that fails to connect is skipped for SEARCH_NODE_RETRY seconds and the
+# select is retried once on another replica.
+SEARCH_SELECT_URLS = None
+SEARCH_SELECT_POLICY = "round_robin"
+SEARCH_NODE_RETRY = 30
+
+# Select result cache: None, "local" (in-process LRU of at most SEARCH_CACHE_SIZE
+# entries) or "django" (the CACHE_BACKEND). Entries live SEARCH_CACHE_TIMEOUT seconds
+# and are dropped on connection.commit()/optimize(). See connection.cache.stats.
+SEARCH_CACHE = None
+SEARCH_CACHE_TIMEOUT = 60
+SEARCH_CACHE_SIZE = 1000
+
+# How select responses are read: "xml" (minidom), "json" (wt=json) or "stream" (XML
+# parsed with SAX straight from the socket, for large responses). All of them produce
+# the same SelectResults.
+SEARCH_RESPONSE_FORMAT = "xml"
+
+# Persistent HTTP connections. Up to SEARCH_POOL_SIZE idle keep-alive connections
+# are kept per Solr host and dropped after SEARCH_POOL_MAX_IDLE seconds of
+# inactivity. SEARCH_TIMEOUT is the socket timeout in seconds (None for no timeout).
+SEARCH_POOL_SIZE = 4
+SEARCH_POOL_MAX_IDLE = 60
+SEARCH_TIMEOUT = None
+
+# A background thread pings SEARCH_PING_URLS every SEARCH_PING_INTERVAL seconds,
+# waiting at most SEARCH_PING_TIMEOUT seconds per node.
+SEARCH_PING_INTERVAL = 30
+SEARCH_PING_TIMEOUT = 2
+
+# Buffered indexing. When True the post_save/post_delete handlers queue documents
+# per thread and send them as one batch when the request ends (add
+# solango.middleware.BufferedIndexMiddleware to MIDDLEWARE_CLASSES), when
+# solango.indexer.flush() is called or when SEARCH_BUFFER_SIZE documents are pending.
+# The main thread's buffer is also flushed at exit; other threads running outside
+# a request (e.g. task queue workers) must call solango.indexer.flush() themselves.
+SEARCH_BUFFERED_INDEXING = False
+SEARCH_BUFFER_SIZE = 500
+
+# When to commit after connection.add/delete:
+#   "immediate" -- after every update (Solr reopens its searcher every time)
+#   "within"    -- send commitWithin=SEARCH_COMMIT_WITHIN millis, Solr commits on its own
+#   "explicit"  -- never, call connection.commit() yourself (bulk jobs)
+#   "interval"  -- at most one commit every SEARCH_COMMIT_INTERVAL seconds
+#                  a postponed commit runs when the interval ends, or at exit
+SEARCH_COMMIT_POLICY = "immediate"
+SEARCH_COMMIT_WITHIN = 1000
+SEARCH_COMMIT_INTERVAL = 10
+
 #### SOLR
 SOLR_ROOT = None
 SOLR_SCHEMA_PATH = None
 SOLR_DATA_DIR = None
 
+# Where `manage.py solr --reindex --incremental` keeps its per-model checkpoints
+SEARCH_CHECKPOINT_FILE = None
+
 ### Default Sorting criteria
 SEARCH_SORT_PARAMS = {
         # "field direction": "anchor" The anchor for display purposes
@@ -24,6 +78,29 @@ SEARCH_FACET_PARAMS = [
     ("facet.field", "model"),      # Facet by model
 ]
 
+# Filters on a facet.field go into a tagged fq which that facet excludes, so
+# it keeps counting the other values. False ANDs them into q instead.
+SEARCH_FACET_MULTISELECT = True
+
+# Parameters sent as their own fq instead of being ANDed into q, mapped to the
+# filter query, where %(value)s is the requested value. Solr caches each fq in
+# its filterCache. A list of names filters them as name:value.
+SEARCH_FILTER_FIELDS = {
+    "model": "model:%(value)s",
+    "site_id": "site_id:%(value)s",
+}
+
+# Solr's mbeans admin handler, read by connection.cache_stats(). Defaults to
+# admin/mbeans next to SEARCH_SELECT_URL.
+SEARCH_MBEANS_URL = None
+
+# Deepest start a page may be selected with, None for no limit. Solr sorts
+# start + rows documents for every select, so deep pages are slow.
+SEARCH_PAGINATOR_MAX_OFFSET = None
+# Past SEARCH_PAGINATOR_MAX_OFFSET pages are either refused ("refuse", the
+# select view answers 404) or fetched with Solr's cursorMark ("cursor").
+SEARCH_PAGINATOR_DEEP_PAGING = "refuse"
+
 SEARCH_HL_PARAMS = [
     ("hl", "true"),      # basic highlighting
     ("hl.fl", "text"),   # What field to highlight
@@ -7,6 +7,9 @@ from optparse import make_option
 import os
 import shutil
 
+def print_progress(stats):
+    print unicode(stats)
+
 class Command(NoArgsCommand):
     option_list = BaseCommand.option_list + (
         make_option('--flush', dest='flush_solr', action='store_true', default=False,
@@ -14,6 +17,21 @@ class Command(NoArgsCommand):
                                              
         make_option('--reindex', dest='index_solr', action='store_true', default=False,
             help='Will reindex Solr from the registry.'),
+        
+        make_option('--workers', dest='workers', type='int', default=1,
+            help='Number of threads posting documents to Solr during --reindex.'),
+        
+        make_option('--batch-size', dest='batch_size', type='int', default=100,
+            help='Number of documents sent per request during --reindex.'),
+        
+        make_option('--processes', dest='processes', type='int', default=0,
+            help='Reindex primary key shards in this many processes, for CPU heavy transforms.'),
+        
+        make_option('--retries', dest='retries', type='int', default=2,
+            help='Number of times a failed shard is retried with --processes.'),
+        
+        make_option('--incremental', dest='incremental', action='store_true', default=False,
+            help='Only reindex objects changed since the last checkpoint in SEARCH_CHECKPOINT_FILE.'),
             
         make_option('--schema', dest='solr_schema', action='store_true', default=False,
             help='Will create the schema.xml in SOLR_SCHEMA_PATH or in the --path.'),
@@ -85,10 +103,21 @@ class Command(NoArgsCommand):
         
         if index_solr:
             import solango
-            if not solango.connection.is_available():
+            if not solango.connection.is_update_available():
                 raise CommandError("Solr connection is not avalible")
             
-            from solango.utils import reindex
+            from solango import indexing
+            from solango.utils import reindex, reindex_sharded, reindex_incremental
             print "Starting to reindex Solr"
-            reindex()
+            if options.get('incremental'):
+                if not getattr(settings, 'SEARCH_CHECKPOINT_FILE', None):
+                    raise CommandError("--incremental requires SEARCH_CHECKPOINT_FILE in settings.py")
+                reindex_incremental(options.get('batch_size'), print_progress)
+            elif options.get('processes'):
+                if indexing.multiprocessing is None:
+                    raise CommandError("--processes requires the multiprocessing module")
+                reindex_sharded(options.get('processes'), options.get('batch_size'),
+                                options.get('retries'), print_progress)
+            else:
+                reindex(options.get('workers'), options.get('batch_size'), print_progress)
             print "Finished the reindex of Solr"
\ No newline at end of file
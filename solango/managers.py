@@ -21,8 +21,12 @@ class SearchManager(models.Manager):
             other objects. This will cut down on DB queries. Instead give them a model 
             representation.
         
+        Returns the list of matching instances in relevance order.  Pass
+        cached, a dictionary of instances by Solr id, to skip loading those
+        (see LazyDocuments.hydrate).
         """
+        cached = kwargs.pop('cached', None)
         kwargs['model'] = get_model_key(self.model)
+        kwargs.setdefault('fl', connection.get_listing_fields([kwargs['model']]))
         results = connection.select(*args, **kwargs)
-        ids = [doc.pk_field.value for doc in results.documents]
-        return self.in_bulk(ids)
\ No newline at end of file
+        return results.documents.hydrate(cached)
\ No newline at end of file
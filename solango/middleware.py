@@ -0,0 +1,21 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+from solango import indexer
+
+class BufferedIndexMiddleware(object):
+    """
+    Sends the documents buffered during a request to Solr as a single batch
+    once the request is done.  Changes buffered by a request that raised are
+    dropped, mirroring django.middleware.transaction.TransactionMiddleware.
+    
+    Requires SEARCH_BUFFERED_INDEXING = True.  Place it above the
+    TransactionMiddleware so the flush happens after the commit.
+    """
+    def process_exception(self, request, exception):
+        indexer.discard()
+    
+    def process_response(self, request, response):
+        indexer.flush()
+        return response
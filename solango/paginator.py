@@ -1,9 +1,20 @@
 #
 # Copyright 2008 Optaros, Inc.
 #
+import urllib
+
+from django.conf import settings
+from django.core.paginator import InvalidPage
+
 from solango import connection
 from solango import utils
 
+# cursorMark needs a sort ending on the uniqueKey, see schema.xml
+CURSOR_TIEBREAK = "id asc"
+
+# What happens to pages past SEARCH_PAGINATOR_MAX_OFFSET
+(REFUSE, CURSOR) = ("refuse", "cursor")
+
 class SearchPaginator(object):
     """
     Pagination. 
@@ -14,14 +25,29 @@ class SearchPaginator(object):
     params than the normal Paginator. 
     
     * next_link
-        * If paginator.has_next() than use paginator.next_link to keep state
+        * If paginator.next_link is set use it to keep state
     * previous_link
-        * If paginator.has_previous() than use paginator.previous_link to keep state
+        * If paginator.previous_link is set use it to keep state
     * results
         * An instance of SelectResults
     
+    Deep pages are expensive, Solr collects and sorts start + rows documents
+    for every select.  SEARCH_PAGINATOR_MAX_OFFSET caps the start of a select
+    and SEARCH_PAGINATOR_DEEP_PAGING decides what happens past it:
+    
+    * refuse
+        * InvalidPage is raised, the select view answers with a 404
+    * cursor
+        * Pages are fetched with Solr's cursorMark, which costs the same at
+          any depth.  Offset paging switches to cursors at the maximum
+          offset: the next link of the last offset page carries its offset,
+          and the cursor is only looked up when that link is followed.  The
+          cursor, and a short trail of earlier ones for the previous link,
+          are carried in the links.  Pages past the maximum offset can only
+          be reached by following next links.
+    
     Template use:
-        {% if paginator.has_previous %}
+        {% if paginator.previous_link %}
             <a href="{{ paginator.previous_link }}">&lt;&lt;</a> | 
         {% endif %}
         {% for link in paginator.links %}
@@ -31,28 +57,121 @@ class SearchPaginator(object):
                 {{ link }} |
             {% endif %}
         {% endfor %}
-        {% if paginator.has_next %}
+        {% if paginator.next_link %}
             <a href="{{ paginator.next_link }}">&gt;&gt;</a>
         {% endif %}
+    
+    links holds the first and last pages and those around the current one,
+    "..." stands for the pages left out, e.g. 1 ... 4 5 6 7 8 ... 2000000.
     """
     
+    # Number of earlier cursors carried in the links for previous_link
+    cursor_trail = 10
+    # Pages linked at either end of the range and on each side of the current page
+    page_edges = 1
+    page_window = 2
+
     def __init__(self, params, request):
-        self.page = int(params.pop('page', 1))
-        self.per_page = int(params.pop('per_page', 5))
-        params['start'] = (self.page-1  ) * self.per_page
+        try:
+            self.page = int(params.pop('page', 1))
+            self.per_page = int(params.pop('per_page', 5))
+        except ValueError:
+            raise InvalidPage('That page number is not an integer')
+
+        if self.page < 1 or self.per_page < 1:
+            raise InvalidPage('That page number is less than 1')
+
+        self.max_offset = getattr(settings, 'SEARCH_PAGINATOR_MAX_OFFSET', None)
+        self.deep_paging = getattr(settings, 'SEARCH_PAGINATOR_DEEP_PAGING', REFUSE)
+
+        if self.deep_paging not in (REFUSE, CURSOR):
+            raise ValueError("Unknown SEARCH_PAGINATOR_DEEP_PAGING: %s" % self.deep_paging)
+
+        # The cursor this page is fetched with, and those of the pages before
+        self.cursor = params.pop('cursor', None)
+        trail = params.pop('trail', '')
+        self.trail = trail and trail.split(',') or []
+        seek = params.pop('seek', None)
+
+        offset = (self.page - 1) * self.per_page
+
+        if self.cursor is None and seek is not None:
+            self.cursor = self._get_seek_cursor(params, seek, offset)
+
+        if self.cursor is None and not self.allows_offset(offset):
+            raise InvalidPage('That page is past SEARCH_PAGINATOR_MAX_OFFSET')
+
         params['rows'] = self.per_page
+        if self.cursor is None:
+            params['start'] = offset
+        else:
+            params['start'] = 0
+            params['cursorMark'] = self.cursor
+            params['sort'] = get_cursor_sort(params.get('sort'))
+
+        self.params = params
         self.results = connection.select(params)
         self.next_link = None
         self.previous_link = None
         self.links = []
         self._get_pagination_links(request)
     
+    def allows_offset(self, offset):
+        """
+        Returns True if a page starting at offset may be selected by offset.
+        """
+        return self.max_offset is None or offset <= self.max_offset
+
+    def _get_cursor_link(self, base, page, cursor, trail):
+        params = [('page', page), ('cursor', cursor)]
+        if trail:
+            params.append(('trail', ','.join(trail[-self.cursor_trail:])))
+        return base + urllib.urlencode(params)
+
+    def _get_seek_cursor(self, params, seek, offset):
+        """
+        Returns the cursor of the first page past the maximum offset, the one
+        the seek link of the last offset page leads to.  Any other seek is
+        refused, a seek reads every id up to its offset.
+        """
+        try:
+            seek = int(seek)
+        except ValueError:
+            raise InvalidPage('That seek offset is not an integer')
+
+        if self.deep_paging != CURSOR or seek != offset or \
+                self.allows_offset(offset) or not self.allows_offset(offset - self.per_page):
+            raise InvalidPage('That page cannot be seeked to')
+
+        return self._seek_cursor(params, offset)
+
+    def _seek_cursor(self, params, offset):
+        """
+        Returns the cursorMark of the document at offset.  Only the ids up to
+        offset are read, with a single cursor select.
+        """
+        from solango.solr.query import Query
+
+        seek = dict(params)
+        seek.update({'start': 0, 'rows': offset, 'fl': ['id'], 'cursorMark': '*',
+                     'sort': get_cursor_sort(seek.get('sort'))})
+
+        query = Query(seek)
+        query.facet.clear()
+        query.hl.clear()
+
+        return connection.select(query).next_cursor_mark
+
     def _get_pagination_links(self, request):
-        base = utils.get_base_url(request,["page",])
+        base = utils.get_base_url(request,["page", "cursor", "trail", "seek"])
         
         links = []
         
         for i in self.page_range():
+
+            if i is None:
+                links.append("...")
+                continue
             
             if i == self.page:
                 links.append(str(i))
@@ -65,26 +184,72 @@ class SearchPaginator(object):
             
             links.append(link)
             
-        if self.has_next:
-            self.next_link = base + "page=" + str(self.page+1)
+        if self.has_next():
+            trail = self.trail
+            if self.cursor is not None:
+                trail = trail + [self.cursor]
             
-        if self.has_previous:
+            next_offset = self.page * self.per_page
+
+            if self.results.next_cursor_mark:
+                self.next_link = self._get_cursor_link(base, self.page + 1,
+                                                       self.results.next_cursor_mark, trail)
+            elif self.allows_offset(next_offset):
+                self.next_link = base + "page=" + str(self.page+1)
+            elif self.deep_paging == CURSOR:
+                # Switch to cursors where offset paging stops, the cursor is
+                # looked up when the link is followed
+                params = [('page', self.page + 1), ('seek', next_offset)]
+                if trail:
+                    params.append(('trail', ','.join(trail[-self.cursor_trail:])))
+                self.next_link = base + urllib.urlencode(params)
+
+        if self.has_previous():
             if self.page == 2:
                 self.previous_link = base.rstrip('?')
-            else:
+            elif self.trail:
+                self.previous_link = self._get_cursor_link(base, self.page - 1,
+                                                           self.trail[-1], self.trail[:-1])
+            elif self.allows_offset((self.page - 2) * self.per_page):
                 self.previous_link = base + "page=" + str(self.page-1)
         
         self.links = links
 
     
     def has_next(self):
-        return self.results.start + self.results.rows < self.results.count
+        return self.page * self.per_page < self.results.count
     
     def has_previous(self):
-        return 0 < self.results.start
+        return self.page > 1
     
     def page_range(self):
-        return range(1, (self.results.count / self.results.rows + 2))
+        """
+        Returns the page numbers to link to: the first and last pages and a
+        window around the current page, with None where pages are left out.
+        The range is the same size whatever the number of results.
+        """
+        last = self.page_count()
+        if self.max_offset is not None:
+            last = min(last, self.max_offset / self.per_page + 1)
+
+        pages = set(range(1, min(self.page_edges, last) + 1))
+        pages.update(range(max(last - self.page_edges + 1, 1), last + 1))
+        pages.update(range(max(self.page - self.page_window, 1),
+                           min(self.page + self.page_window, last) + 1))
+        pages.add(self.page)
+
+        ret = []
+        previous = 0
+        for i in sorted(pages):
+            if i == previous + 2:
+                # No point hiding a single page
+                ret.append(previous + 1)
+            elif i > previous + 2:
+                ret.append(None)
+            ret.append(i)
+            previous = i
+
+        return ret
     
     def has_other_pages(self):
         return self.has_previous() or self.has_next()
@@ -96,10 +261,21 @@ class SearchPaginator(object):
         return self.page - 1
     
     def page_count(self):
-        return  (self.results.count % self.results.rows + 1)
+        return (self.results.count + self.per_page - 1) / self.per_page
     
     def facets(self):
         return self.results.facets
     
     def documents(self):
-        return self.results.documents
\ No newline at end of file
+        return self.results.documents
+
+def get_cursor_sort(sort):
+    """
+    Returns sort, a sort param or a list of them, with the tiebreak cursorMark
+    requires.
+    """
+    if not sort:
+        sort = ['score desc']
+    elif isinstance(sort, basestring):
+        sort = [sort]
+    return list(sort) + [CURSOR_TIEBREAK]
@@ -16,6 +16,15 @@ from django.conf import settings
 def get_model_key(model):
     return '%s%s%s' % (model._meta.app_label, settings.SEARCH_SEPARATOR ,model._meta.module_name)
 
+def get_document_id(model_or_key, pk):
+    """
+    Returns the unique Solr id of the object of model (or model key) with the
+    specified primary key, e.g. blog__entry__1
+    """
+    if not isinstance(model_or_key, basestring):
+        model_or_key = get_model_key(model_or_key)
+    return '%s%s%s' % (model_or_key, settings.SEARCH_SEPARATOR, pk)
+
 def get_model_from_key(type):
     app_label, module_name = type.split(settings.SEARCH_SEPARATOR)
     return get_model(app_label, module_name)
\ No newline at end of file
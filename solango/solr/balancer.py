@@ -0,0 +1,106 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Spreads select requests over several Solr replicas.
+
+Updates always go to the master (SEARCH_UPDATE_URL); selects pick one of
+SEARCH_SELECT_URLS according to SEARCH_SELECT_POLICY:
+
+    round_robin       -- each healthy replica in turn
+    least_outstanding -- the healthy replica with the fewest requests in flight
+
+A replica is skipped while the HealthMonitor reports its host as down, or
+for SEARCH_NODE_RETRY seconds after a select to it failed to connect.
+"""
+
+import threading
+import time
+import urlparse
+
+(ROUND_ROBIN, LEAST_OUTSTANDING) = ("round_robin", "least_outstanding")
+
+class SelectNode(object):
+    """
+    A replica select URL and its bookkeeping.
+    """
+    def __init__(self, url):
+        self.url = url
+        self.host = urlparse.urlparse(url)[1]
+        (self.outstanding, self.requests, self.failures) = (0, 0, 0)
+        self.failed_at = None
+
+class SelectBalancer(object):
+
+    def __init__(self, urls, policy=ROUND_ROBIN, retry_after=30, monitor=None):
+        if policy not in (ROUND_ROBIN, LEAST_OUTSTANDING):
+            raise ValueError("Unknown SEARCH_SELECT_POLICY: %s" % policy)
+
+        self.nodes = [SelectNode(url) for url in urls]
+        (self.policy, self.retry_after, self.monitor) = (policy, retry_after, monitor)
+        self._next = 0
+        self._lock = threading.Lock()
+
+        # Ping URLs of the monitor by host, so a node can be matched to its ping
+        self._ping_urls = {}
+        if monitor:
+            for url in monitor.nodes.keys():
+                self._ping_urls[urlparse.urlparse(url)[1]] = url
+
+    def is_healthy(self, node, now):
+        """
+        Returns False if node failed recently or its host is down.
+        """
+        if node.failed_at is not None and now - node.failed_at < self.retry_after:
+            return False
+
+        ping_url = self._ping_urls.get(node.host)
+        if ping_url and self.monitor.nodes[ping_url].healthy is False:
+            return False
+
+        return True
+
+    def acquire(self, exclude=()):
+        """
+        Picks the node for the next select and marks a request as outstanding
+        on it.  Nodes in exclude are only used if nothing else is left.  If
+        every node looks unhealthy they are tried anyway rather than failing
+        outright.
+        """
+        now = time.time()
+
+        self._lock.acquire()
+        try:
+            candidates = [n for n in self.nodes if n not in exclude and self.is_healthy(n, now)]
+            if not candidates:
+                candidates = [n for n in self.nodes if n not in exclude] or self.nodes
+
+            if self.policy == LEAST_OUTSTANDING:
+                node = min(candidates, key=lambda n: n.outstanding)
+            else:
+                node = candidates[self._next % len(candidates)]
+                self._next += 1
+
+            node.outstanding += 1
+            node.requests += 1
+        finally:
+            self._lock.release()
+
+        return node
+
+    def release(self, node, failed=False):
+        """
+        Marks the request on node as finished.  failed means the node could not
+        be reached and should be skipped for a while.
+        """
+        self._lock.acquire()
+        try:
+            node.outstanding -= 1
+            if failed:
+                node.failures += 1
+                node.failed_at = time.time()
+            else:
+                node.failed_at = None
+        finally:
+            self._lock.release()
@@ -0,0 +1,191 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Caches select results in front of SearchWrapper.select.
+
+Entries are keyed on the normalized query string, so the order of the
+parameters does not matter.  Both stores keep the raw response and parse it
+again on every hit, so each caller gets SelectResults of its own.  Two stores
+are available (SEARCH_CACHE):
+
+    local  -- an in-process LRU cache holding at most SEARCH_CACHE_SIZE entries.
+    django -- the Django cache framework (CACHE_BACKEND); eviction is left to
+              the backend.
+
+Entries expire after SEARCH_CACHE_TIMEOUT seconds.  Commits and optimizes
+issued through SearchWrapper clear the cache; for the local store that only
+covers the current process, other processes rely on the timeout.
+"""
+
+import cgi
+import hashlib
+import threading
+import time
+import urllib
+
+def normalize(query_string):
+    """
+    Returns query_string with its parameters in a canonical order.  Only the
+    names are sorted, repeated parameters such as facet.field keep the order
+    of their values, which decides the order of the facets.
+    """
+    params = cgi.parse_qsl(query_string, keep_blank_values=True)
+    params.sort(key=lambda param: param[0])
+    return urllib.urlencode(params)
+
+class BaseResultCache(object):
+    """
+    Hit and miss counting shared by the cache stores, which provide _get,
+    _set and clear.
+    """
+    def __init__(self, parse, timeout=60):
+        (self.parse, self.timeout) = (parse, timeout)
+        (self.hits, self.misses, self.evictions) = (0, 0, 0)
+        self._lock = threading.Lock()
+
+    def get(self, query_string):
+        """
+        Returns SelectResults parsed from the response cached for
+        query_string, or None.
+        """
+        response = self._get(normalize(query_string))
+
+        self._lock.acquire()
+        try:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        finally:
+            self._lock.release()
+
+        if response is None:
+            return None
+        return self.parse(response)
+
+    def set(self, query_string, response):
+        """
+        Caches the raw response for query_string.
+        """
+        self._set(normalize(query_string), response)
+
+    @property
+    def stats(self):
+        """
+        Returns a dictionary of hit, miss and eviction counts.
+        """
+        self._lock.acquire()
+        try:
+            (hits, misses, evictions) = (self.hits, self.misses, self.evictions)
+        finally:
+            self._lock.release()
+        lookups = hits + misses
+        return {'hits': hits, 'misses': misses, 'evictions': evictions,
+                'hit_ratio': lookups and float(hits) / lookups or 0.0}
+
+class LocalResultCache(BaseResultCache):
+    """
+    Thread-safe in-process LRU cache with a time to live.
+    """
+    (PREV, NEXT, KEY, VALUE, EXPIRES) = range(5)
+
+    def __init__(self, parse, timeout=60, size=1000):
+        BaseResultCache.__init__(self, parse, timeout)
+        self.size = size
+        self.clear()
+
+    def _unlink(self, link):
+        (prev, next) = (link[self.PREV], link[self.NEXT])
+        prev[self.NEXT] = next
+        next[self.PREV] = prev
+
+    def _append(self, link):
+        # The most recently used entry sits right before the root.
+        last = self._root[self.PREV]
+        (link[self.PREV], link[self.NEXT]) = (last, self._root)
+        last[self.NEXT] = self._root[self.PREV] = link
+
+    def _get(self, key):
+        self._lock.acquire()
+        try:
+            link = self._map.get(key)
+            if link is None:
+                return None
+            if link[self.EXPIRES] < time.time():
+                self._unlink(link)
+                del self._map[key]
+                return None
+            self._unlink(link)
+            self._append(link)
+            return link[self.VALUE]
+        finally:
+            self._lock.release()
+
+    def _set(self, key, response):
+        self._lock.acquire()
+        try:
+            link = self._map.get(key)
+            if link is not None:
+                self._unlink(link)
+            link = [None, None, key, response, time.time() + self.timeout]
+            self._map[key] = link
+            self._append(link)
+
+            while len(self._map) > self.size:
+                oldest = self._root[self.NEXT]
+                self._unlink(oldest)
+                del self._map[oldest[self.KEY]]
+                self.evictions += 1
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._map = {}
+            self._root = []
+            self._root[:] = [self._root, self._root, None, None, None]
+        finally:
+            self._lock.release()
+
+class DjangoResultCache(BaseResultCache):
+    """
+    Stores raw responses in the Django cache.  Clearing bumps a generation
+    number that is part of every key, which invalidates all processes at once.
+    """
+    (GENERATION_KEY, GENERATION_TIMEOUT) = ('solango:generation', 86400)
+
+    def __init__(self, parse, timeout=60):
+        from django.core.cache import cache
+        BaseResultCache.__init__(self, parse, timeout)
+        self.cache = cache
+
+    def _make_key(self, key):
+        generation = self.cache.get(self.GENERATION_KEY)
+        if generation is None:
+            generation = str(time.time())
+            self.cache.set(self.GENERATION_KEY, generation, self.GENERATION_TIMEOUT)
+        return 'solango:%s:%s' % (generation, hashlib.md5(key).hexdigest())
+
+    def _get(self, key):
+        return self.cache.get(self._make_key(key))
+
+    def _set(self, key, response):
+        self.cache.set(self._make_key(key), response, self.timeout)
+
+    def clear(self):
+        self.cache.set(self.GENERATION_KEY, str(time.time()), self.GENERATION_TIMEOUT)
+
+def get_cache(backend, parse, timeout=60, size=1000):
+    """
+    Returns the result cache for the SEARCH_CACHE setting, or None.
+    """
+    if not backend:
+        return None
+    if backend == 'local':
+        return LocalResultCache(parse, timeout, size)
+    if backend == 'django':
+        return DjangoResultCache(parse, timeout)
+    raise ValueError("Unknown SEARCH_CACHE: %s" % backend)
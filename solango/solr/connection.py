@@ -2,24 +2,68 @@
 # Copyright 2008 Optaros, Inc.
 #
 
-from datetime import datetime, timedelta
-import urllib2
+import copy
+import threading
+import time
+import urllib
+from xml.sax.saxutils import escape
 
 from django.conf import settings
+from django.utils import simplejson
 from solango.log import logger
-from solango.solr import results
+from solango import registry
+from solango.solr import results, get_document_id, get_model_key
+from solango.solr.balancer import SelectBalancer
+from solango.solr.cache import get_cache
+from solango.solr.monitor import HealthMonitor
+from solango.solr.pool import HTTPConnectionPool, ConnectionError
 from solango.solr.query import Query
 
 (DELETE, ADD) = (0,1)
 
+# Approximate size in bytes of the chunks an update body is streamed in
+CHUNK_SIZE = 64 * 1024
+
+# Commit policies, see SEARCH_COMMIT_POLICY
+(COMMIT_IMMEDIATE, COMMIT_WITHIN, COMMIT_EXPLICIT, COMMIT_INTERVAL) = \
+    ("immediate", "within", "explicit", "interval")
+
+class UpdateBody(object):
+    """
+    A lazily serialized update message.  Iterating it yields the message as
+    UTF-8 encoded chunks of roughly CHUNK_SIZE bytes, so a batch never has to
+    sit in memory as a single string.  It can be iterated more than once,
+    which lets the connection pool resend it on a fresh connection.
+    """
+    def __init__(self, start, iter_xml, documents, mode, end):
+        (self.start, self.iter_xml, self.end) = (start, iter_xml, end)
+        (self.documents, self.mode) = (documents, mode)
+    
+    def __nonzero__(self):
+        return True
+    
+    def __iter__(self):
+        (buf, size) = ([self.start.encode("utf-8")], 0)
+        for xml in self.iter_xml(self.documents, self.mode):
+            data = xml.encode("utf-8", "replace")
+            buf.append(data)
+            size += len(data)
+            if size >= CHUNK_SIZE:
+                yield "".join(buf)
+                (buf, size) = ([], 0)
+        buf.append(self.end.encode("utf-8"))
+        yield "".join(buf)
+    
+    def __unicode__(self):
+        return "".join(self).decode("utf-8")
+
 class SearchWrapper(object):
     """
     This class is the entry point for all search-bound actions, including
     adding (indexing), deleting, and selecting (searching).  It is a singleton,
     and should always be accessed via get_instance.
     """
-    (available, heartbeat) = (False, None)
-    (update_url, select_url, ping_urls) = (None, None, None)
+    (update_url, select_url, select_urls, ping_urls) = (None, None, None, None)
     
     def __init__(self):
         """
@@ -27,28 +71,67 @@ class SearchWrapper(object):
         """
         self.update_url = settings.SEARCH_UPDATE_URL
         self.select_url = settings.SEARCH_SELECT_URL
+        self.select_urls = getattr(settings, 'SEARCH_SELECT_URLS', None) or [self.select_url]
         self.ping_urls = settings.SEARCH_PING_URLS
-  
-        self.heartbeat = datetime(1970, 01, 01)
+        # Solr's admin handler reporting cache statistics, next to select
+        self.mbeans_url = getattr(settings, 'SEARCH_MBEANS_URL', None) or \
+            self.select_url.rstrip('/').rsplit('/', 1)[0] + '/admin/mbeans'
+        
+        # Shared by select, update and the availability pings.
+        self.pool = HTTPConnectionPool(
+            size=getattr(settings, 'SEARCH_POOL_SIZE', 4),
+            timeout=getattr(settings, 'SEARCH_TIMEOUT', None),
+            max_idle=getattr(settings, 'SEARCH_POOL_MAX_IDLE', 60))
+        
+        self.commit_policy = getattr(settings, 'SEARCH_COMMIT_POLICY', COMMIT_IMMEDIATE)
+        self.commit_within = getattr(settings, 'SEARCH_COMMIT_WITHIN', 1000)
+        self.commit_interval = getattr(settings, 'SEARCH_COMMIT_INTERVAL', 10)
+        
+        if self.commit_policy not in (COMMIT_IMMEDIATE, COMMIT_WITHIN, COMMIT_EXPLICIT, COMMIT_INTERVAL):
+            raise ValueError("Unknown SEARCH_COMMIT_POLICY: %s" % self.commit_policy)
+        
+        (self._last_commit, self._commit_timer) = (0, None)
+        self._commit_lock = threading.Lock()
+        
+        self.monitor = HealthMonitor(self.pool, self.ping_urls,
+            interval=getattr(settings, 'SEARCH_PING_INTERVAL', 30),
+            timeout=getattr(settings, 'SEARCH_PING_TIMEOUT', 2))
+        
+        # Selects are spread over the replicas, updates go to update_url
+        self.balancer = SelectBalancer(self.select_urls,
+            policy=getattr(settings, 'SEARCH_SELECT_POLICY', 'round_robin'),
+            retry_after=getattr(settings, 'SEARCH_NODE_RETRY', 30),
+            monitor=self.monitor)
+        
+        self.response_format = getattr(settings, 'SEARCH_RESPONSE_FORMAT', 'xml')
+        if self.response_format not in ('xml', 'json', 'stream'):
+            raise ValueError("Unknown SEARCH_RESPONSE_FORMAT: %s" % self.response_format)
+        
+        self.cache = get_cache(getattr(settings, 'SEARCH_CACHE', None), self.parse_select,
+            timeout=getattr(settings, 'SEARCH_CACHE_TIMEOUT', 60),
+            size=getattr(settings, 'SEARCH_CACHE_SIZE', 1000))
     
     def is_available(self):
         """
-        Returns True if the search system appears to be available and in good
-        health, False otherwise.  A ping is periodically sent to the search
-        server to query its availability.
+        Returns True if search appears to be available, that is if at least
+        one of the select replicas is in good health, False otherwise.  The
+        answer comes from the background HealthMonitor, which pings the search
+        servers every SEARCH_PING_INTERVAL seconds; only the very first call
+        waits on a ping.
         """
-        (now, delta) = (datetime.now(), timedelta(0, 300))
-        
-        if now - self.heartbeat > delta:
-            try:
-                for url in self.ping_urls:
-                    res = urllib2.urlopen(url).read()
-            except StandardError:
-                self.available = False
-            else:
-                self.available = True
-            
-        return self.available
+        self.monitor.ensure_started()
+        for url in self.select_urls:
+            if self.monitor.get_health(url):
+                return True
+        return False
+    
+    def is_update_available(self):
+        """
+        Returns True if the update node, SEARCH_UPDATE_URL, appears to be in
+        good health.  Replicas being down does not stop updates.
+        """
+        self.monitor.ensure_started()
+        return self.monitor.get_health(self.update_url)
     
     def get_document_xml(self, documents, mode):
         """
@@ -61,62 +144,212 @@ class SearchWrapper(object):
         if not isinstance(documents, (list, tuple)):
             documents = [documents]
         
-        xml = unicode("", "utf-8")
+        return u"".join(self.iter_document_xml(documents, mode))
+    
+    def iter_document_xml(self, documents, mode):
+        """
+        Yields the Solr Document XML of the specified objects one document at
+        a time, transformed according to mode.
+        """
         for d in documents:
             if mode:
-                xml += d.add()
+                yield d.add()
             else:
-                xml += d.delete()
-        return xml
+                yield d.delete()
     
-    def add(self, documents):
+    def get_update_xml(self, tag, documents, mode):
+        """
+        Returns an UpdateBody wrapping the documents in an <add> or <delete>
+        element, requesting a commitWithin when the commit policy asks for one.
+        """
+        if not isinstance(documents, (list, tuple)):
+            documents = [documents]
+        
+        return UpdateBody(self.get_update_start(tag), self.iter_document_xml, documents, mode,
+                          "</%s>\n" % tag)
+    
+    def get_update_start(self, tag):
+        """
+        Returns the opening <add> or <delete> tag, with a commitWithin when the
+        commit policy asks for one.
+        """
+        if self.commit_policy == COMMIT_WITHIN:
+            return "\n<%s commitWithin=\"%d\">\n" % (tag, self.commit_within)
+        return "\n<%s>\n" % tag
+    
+    def commit_after_update(self):
+        """
+        Applies the commit policy after an add or delete.  Returns the
+        UpdateResults of the commit, or None if no commit was issued now.
+        
+        immediate -- commit after every update
+        within    -- Solr commits on its own within SEARCH_COMMIT_WITHIN millis
+        explicit  -- never, call commit() when done (bulk jobs)
+        interval  -- at most one commit per SEARCH_COMMIT_INTERVAL seconds; a
+                     commit skipped inside the interval runs when it ends
+        """
+        if self.commit_policy == COMMIT_IMMEDIATE:
+            return self.commit()
+        
+        if self.commit_policy != COMMIT_INTERVAL:
+            return None
+        
+        self._commit_lock.acquire()
+        try:
+            wait = self._last_commit + self.commit_interval - time.time()
+            if wait > 0 and not self._commit_timer:
+                self._commit_timer = threading.Timer(wait, self._deferred_commit)
+                self._commit_timer.setDaemon(True)
+                self._commit_timer.start()
+        finally:
+            self._commit_lock.release()
+        
+        if wait > 0:
+            return None
+        return self.commit()
+    
+    def _deferred_commit(self):
+        """
+        Runs the commit postponed by the interval policy.
+        """
+        try:
+            self.commit()
+        except StandardError, e:
+            logger.error("deferred commit: %s" % e)
+    
+    def flush_commit(self):
+        """
+        Runs the commit postponed by the interval policy now, if there is one.
+        Returns its UpdateResults, or None if no commit was pending.
+        """
+        self._commit_lock.acquire()
+        try:
+            pending = self._commit_timer is not None
+        finally:
+            self._commit_lock.release()
+        
+        if pending:
+            return self.commit()
+        return None
+    
+    def add(self, documents, commit=True):
         """
         Adds the specified list of objects to the search index.  Returns a
         two-element List of UpdateResults; the first element corresponds to
-        the add operation, the second to the subsequent commit operation.
+        the add operation, the second to the subsequent commit operation, or
+        None if the commit policy did not commit right away.  With commit=False
+        the commit policy is skipped altogether.
         """
         if not documents:
             raise ValueError        
         
-        xml = self.get_document_xml(documents, ADD)
-        
-        if not len(xml):
-            return
-        
-        if not self.is_available():
+        if not self.is_update_available():
             logger.info("add: Search is unavailable.")
             return
         
-        res = self.update("\n<add>\n" + xml + "</add>\n")
-        return [results.UpdateResults(res), self.commit()]
+        res = self.update(self.get_update_xml("add", documents, ADD))
+        if not commit:
+            return [results.UpdateResults(res), None]
+        return [results.UpdateResults(res), self.commit_after_update()]
     
-    def delete(self, documents):
+    def delete(self, documents, commit=True):
         """
         Deletes the specified list of objects from the search index.  Returns
         a two-element List of UpdateResults; the first element corresponds to
-        the delete operation, the second to the subsequent commit operation.
+        the delete operation, the second to the subsequent commit operation, or
+        None if the commit policy did not commit right away.  With commit=False
+        the commit policy is skipped altogether.
         """
         if not documents:
             raise ValueError
  
-        xml = self.get_document_xml(documents, DELETE)
-        
-        if not len(xml):
+        if not self.is_update_available():
+            logger.info("delete: Search is unavailable.")
             return
         
-        if not self.is_available():
+        res = self.update(self.get_update_xml("delete", documents, DELETE))
+        if not commit:
+            return [results.UpdateResults(res), None]
+        return [results.UpdateResults(res), self.commit_after_update()]
+    
+    def delete_by_id(self, ids, commit=True):
+        """
+        Deletes the documents with the specified Solr ids (e.g.
+        blog__entry__1) in a single <delete> message, without building the
+        documents.  Returns the same two-element List as delete.
+        """
+        if not ids:
+            raise ValueError
+        
+        xml = [self.get_update_start("delete")]
+        for id in ids:
+            xml.append("<id>%s</id>\n" % escape(unicode(id)))
+        xml.append("</delete>\n")
+        
+        return self._delete_xml(u"".join(xml), commit)
+    
+    def delete_by_pk(self, model_or_key, pks, commit=True):
+        """
+        Deletes the documents of a model (or model key) by primary key.
+        """
+        return self.delete_by_id([get_document_id(model_or_key, pk) for pk in pks], commit)
+    
+    def delete_by_query(self, query, commit=True):
+        """
+        Deletes every document matching the specified Lucene query.
+        """
+        if not query:
+            raise ValueError
+        
+        xml = u"%s<query>%s</query>\n</delete>\n" % (self.get_update_start("delete"), escape(query))
+        return self._delete_xml(xml, commit)
+    
+    def delete_model(self, model_or_key, site_id=None, commit=True):
+        """
+        Purges every document of a model (or model key), optionally only those
+        of a single site.
+        """
+        if not isinstance(model_or_key, basestring):
+            model_or_key = get_model_key(model_or_key)
+        
+        query = 'model:"%s"' % model_or_key
+        if site_id is not None:
+            query += ' AND site_id:%d' % int(site_id)
+        return self.delete_by_query(query, commit)
+    
+    def delete_site(self, site_id, commit=True):
+        """
+        Purges every document of a site.
+        """
+        return self.delete_by_query('site_id:%d' % int(site_id), commit)
+    
+    def _delete_xml(self, xml, commit):
+        if not self.is_update_available():
             logger.info("delete: Search is unavailable.")
             return
         
-        res = self.update("\n<delete>\n" + xml + "</delete>\n")
-        return [results.UpdateResults(res), self.commit()]
+        res = self.update(xml)
+        if not commit:
+            return [results.UpdateResults(res), None]
+        return [results.UpdateResults(res), self.commit_after_update()]
     
     def commit(self):
         """
         Commits any pending changes to the search index.  Returns an
         UpdateResults instance.
         """
+        self._commit_lock.acquire()
+        try:
+            self._last_commit = time.time()
+            if self._commit_timer:
+                self._commit_timer.cancel()
+                self._commit_timer = None
+        finally:
+            self._commit_lock.release()
+        
         res = self.update(unicode("\n<commit/>\n", "utf-8"))
+        if self.cache:
+            self.cache.clear()
         return results.UpdateResults(res)
     
     def optimize(self):
@@ -124,24 +357,50 @@ class SearchWrapper(object):
         Optimizes the search index.  Returns an UpdateResults instance.
         """
         res = self.update(unicode("\n<optimize/>\n", "utf-8"))
+        if self.cache:
+            self.cache.clear()
         return results.UpdateResults(res)
             
+    def cache_stats(self, url=None):
+        """
+        Returns the statistics of Solr's own caches, filterCache,
+        queryResultCache, documentCache and so on, read from the mbeans admin
+        handler at url (SEARCH_MBEANS_URL by default).  Example:
+        
+            {u'filterCache': {u'lookups': 120, u'hits': 96, u'hitratio': 0.8,
+                              u'inserts': 24, u'evictions': 0, u'size': 24, ...},
+             ...}
+        
+        Raises ConnectionError or HTTPError if the handler can't be reached.
+        """
+        (status, data) = self.pool.request((url or self.mbeans_url) +
+                                           "?cat=CACHE&stats=true&wt=json&json.nl=map")
+        
+        stats = {}
+        for name, info in simplejson.loads(data).get("solr-mbeans", {}).get("CACHE", {}).items():
+            # Newer Solr prefixes the keys, e.g. CACHE.searcher.filterCache.hits
+            stats[name] = dict([(key.split(".")[-1], value)
+                                for key, value in (info.get("stats") or {}).items()])
+        return stats
+    
     def issue_request(self, url, content=None):
         """
         Submits the specified Unicode content to the specified URL.  Returns
         the raw response content as a string, or None if an error occurs.
+        content may also be an UpdateBody, which is streamed.
         """
-        if content: 
+        if isinstance(content, basestring):
             data = content.encode("utf-8", "replace")
+        elif content:
+            data = content
         else:
             data = None
         
-        (req, res) = (urllib2.Request(url, data), None)
-        
-        req.add_header("Content-type", "text/xml; charset=utf-8")
+        res = None
         
         try:
-            res = urllib2.urlopen(req).read()
+            (status, res) = self.pool.request(url, data,
+                {"Content-type": "text/xml; charset=utf-8"})
         except StandardError, e:
             print str(e)
             logger.error(e)
@@ -149,13 +408,54 @@ class SearchWrapper(object):
     
     def update(self, content):
         """
-        Submits the specified Unicode content to Solr's update interface (POST).
+        Submits the specified Unicode content or UpdateBody to Solr's update
+        interface (POST).
         """
         if not content:
             raise ValueError
         
         return self.issue_request(self.update_url, content)
     
+    def issue_select(self, query_string, parse=None):
+        """
+        Submits query_string to one of the replica select URLs.  A select that
+        cannot connect is retried once on a different replica.  Returns the
+        raw response content as a string, or None if an error occurs.
+        
+        If parse is given the response is not read into a string; parse is
+        called with a file-like object streaming it and its result returned.
+        """
+        tried = []
+        
+        while True:
+            node = self.balancer.acquire(exclude=tried)
+            try:
+                if parse:
+                    stream = self.pool.urlopen(node.url + "?" + query_string)
+                    try:
+                        res = parse(stream)
+                    finally:
+                        stream.close()
+                else:
+                    (status, res) = self.pool.request(node.url + "?" + query_string)
+            except ConnectionError, e:
+                self.balancer.release(node, failed=True)
+                logger.error(e)
+                tried.append(node)
+                if len(tried) > 1 or len(self.balancer.nodes) < 2:
+                    return None
+                continue
+            except StandardError, e:
+                self.balancer.release(node)
+                logger.error(e)
+                return None
+            except:
+                self.balancer.release(node)
+                raise
+            
+            self.balancer.release(node)
+            return res
+    
     def select(self, *args, **kwargs):
         """
         Submits the specified query to Solr's select interface (GET).
@@ -174,8 +474,81 @@ class SearchWrapper(object):
         else:
             query = Query(*args, **kwargs)
         
+        if not query.fl:
+            # On a copy, the caller's query is left as it was
+            query = copy.copy(query)
+            query.fl = self.get_listing_fields()
+        
         print query.url
+        query_string = query.url
+        if self.response_format == 'json':
+            query_string += '&wt=json&json.nl=arrarr'
+        
+        res = None
+        if self.cache:
+            res = self.cache.get(query_string)
+        
         # Submits the response to solr
-        response = self.issue_request(self.select_url + "?" + query.url)
+        if res is None and self.response_format == 'stream' and not self.cache:
+            # Parsed as it arrives, there is no body to keep
+            res = self.issue_select(query_string, results.StreamingSelectResults) or \
+                self.parse_select(None)
+        elif res is None:
+            response = self.issue_select(query_string)
+            res = self.parse_select(response)
+            
+            if self.cache:
+                self.cache.set(query_string, response)
+        
+        # Fields missing from the response are only loaded if fl left them out
+        res.documents.set_fl(query.fl)
+        return res
+    
+    def get_listing_fields(self, model_keys=None):
+        """
+        Returns the fl for a select over the documents of model_keys, by
+        default every registered document: the union of their listing
+        fields.  Returns [], all fields, if one of them has no listing_fields.
+        """
+        fl = []
+        for key in model_keys or registry.keys():
+            document = registry.get(key)
+            if document is None or not document.listing_fl:
+                return []
+            fl.extend([name for name in document.listing_fl if name not in fl])
+        return fl
+    
+    def get_by_ids(self, ids, key='id'):
+        """
+        Selects the documents with the specified Solr ids, with all their
+        stored fields, in one request.  Returns a dictionary of their raw
+        field dictionaries by id, or None if the select failed.
+        """
+        if not ids:
+            return {}
+        
+        terms = ' OR '.join(['"%s"' % id for id in ids])
+        params = [('q', ('%s:(%s)' % (key, terms)).encode('utf-8')),
+                  ('fl', '*'), ('start', 0), ('rows', len(ids))]
+        query_string = urllib.urlencode(params)
+        if self.response_format == 'json':
+            query_string += '&wt=json&json.nl=arrarr'
+        
+        response = self.issue_select(query_string)
+        if response is None:
+            logger.error("get_by_ids: Search is unavailable, %d documents not fetched" % len(ids))
+            return None
+        
+        documents = self.parse_select(response).documents
+        return dict([(documents.raw(i)[key], documents.raw(i)) for i in range(len(documents))])
     
+    def parse_select(self, response):
+        """
+        Parses a raw select response into SelectResults, according to
+        SEARCH_RESPONSE_FORMAT.
+        """
+        if self.response_format == 'json':
+            return results.JSONSelectResults(response)
+        if self.response_format == 'stream':
+            return results.StreamingSelectResults(response)
         return results.SelectResults(response)
\ No newline at end of file
@@ -46,6 +46,10 @@ And finally register it for searching:
     solango.register(Post, PostDocument)
 """
 
+import copy
+from fnmatch import fnmatchcase
+import re
+
 from django.utils.datastructures import SortedDict
 from django.db.models.base import ModelBase, Model
 from django.forms.models import model_to_dict
@@ -53,13 +57,59 @@ from django.template.loader import render_to_string
 
 from solango import fields as search_fields
 
-from copy import deepcopy
-
 __all__ = ('SearchDocumentBase', 'SearchDocument')
 
+# Options a document may declare in its inner Meta class
+META_OPTIONS = ('timestamp_field', 'listing_fields', 'select_related', 'prefetch_related')
+
+# Value of a field that was left out of the select, see Meta.listing_fields
+DEFERRED = object()
+
 class NoPrimaryKeyFieldException(Exception):
     pass
 
+def get_selected_fields(fl):
+    """
+    Returns the Solr field names and name patterns a select asked for, from
+    its fl params, or None if it asked for every stored field.
+    """
+    names = []
+    for value in fl or []:
+        names.extend([name for name in re.split(r'[\s,]+', value) if name])
+    if not names or '*' in names:
+        return None
+    return names
+
+def is_selected(name, selected):
+    """
+    Returns True if the Solr field name is among selected, see
+    get_selected_fields.
+    """
+    if selected is None or name in selected:
+        return True
+    for pattern in selected:
+        if '*' in pattern and fnmatchcase(name, pattern):
+            return True
+    return False
+
+def get_legacy_method(index, field, name):
+    """
+    Returns a plan method for a field whose class overrides the old
+    transform(model) or clean() hook, or None if it doesn't.  Those hooks
+    read and set field.value, so each call works on its own copy of the
+    field, given the document's value, and the shared field is left alone.
+    """
+    if getattr(type(field), name).im_func is getattr(search_fields.Field, name).im_func:
+        return None
+    
+    def method(document, *args):
+        bound = copy.copy(field)
+        if name == 'clean':
+            bound.value = document._values[index]
+        getattr(bound, name)(*args)
+        return bound.value
+    return method
+
 def get_model_declared_fields(bases, attrs, with_base_fields=True):
     """
     Taken from NewForms
@@ -98,21 +148,163 @@ def get_model_declared_fields(bases, attrs, with_base_fields=True):
     if template:
         attrs['template'] = template
     
+    for option in META_OPTIONS:
+        if hasattr(Meta, option):
+            attrs[option] = getattr(Meta, option)
+    
     return SortedDict(fields)
 
 
+class BoundField(object):
+    """
+    A field of one document.  The value and highlight are stored on the
+    document, everything else is read from the shared field definition.
+    """
+    __slots__ = ('document', 'index', 'field')
+    
+    def __init__(self, document, index):
+        (self.document, self.index) = (document, index)
+        self.field = document.field_list[index]
+    
+    def __getattr__(self, name):
+        return getattr(self.field, name)
+    
+    def _get_value(self):
+        value = self.document._values[self.index]
+        if value is DEFERRED:
+            self.document.load_deferred()
+            value = self.document._values[self.index]
+        return value
+    
+    def _set_value(self, value):
+        self.document._values[self.index] = value
+    
+    value = property(_get_value, _set_value)
+    
+    def _get_highlight(self):
+        if self.document._highlights is None:
+            return None
+        return self.document._highlights[self.index]
+    
+    def _set_highlight(self, highlight):
+        if self.document._highlights is None:
+            self.document._highlights = [None] * len(self.document.field_list)
+        self.document._highlights[self.index] = highlight
+    
+    highlight = property(_get_highlight, _set_highlight)
+    
+    def __unicode__(self):
+        return self.field.to_xml(self.value)
+    
+    def highlighting(self, limit=100):
+        """
+        Used in the template
+        
+        if the document has a highlight value, return it, else fall back on the default value
+        """
+        if self.highlight:
+            return self.highlight
+        
+        return self.value[:limit]
+
+class BoundFields(object):
+    """
+    The read-only, ordered mapping of field names to BoundFields returned by
+    document.fields.
+    """
+    __slots__ = ('document',)
+    
+    def __init__(self, document):
+        self.document = document
+    
+    def __getitem__(self, name):
+        return BoundField(self.document, self.document.field_index[name])
+    
+    def __contains__(self, name):
+        return name in self.document.field_index
+    
+    def __len__(self):
+        return len(self.document.field_list)
+    
+    def __iter__(self):
+        return iter(self.keys())
+    
+    def get(self, name, default=None):
+        if name in self.document.field_index:
+            return self[name]
+        return default
+    
+    def keys(self):
+        return self.document.base_fields.keys()
+    
+    def values(self):
+        return [BoundField(self.document, i) for i in range(len(self.document.field_list))]
+    
+    def items(self):
+        return zip(self.keys(), self.values())
+
 class DeclarativeFieldsMetaclass(type):
     """
     Taken from NewForms
     """
     def __new__(cls, name, bases, attrs):
         attrs['base_fields'] = get_model_declared_fields(bases, attrs)
+        
+        # Documents store their values in a list in field order
+        attrs['field_list'] = attrs['base_fields'].values()
+        attrs['field_index'] = dict([(field_name, i) for i, field_name in enumerate(attrs['base_fields'].keys())])
+        attrs['pk_index'] = None
+        for i, field in enumerate(attrs['field_list']):
+            if isinstance(field, search_fields.PrimaryKeyField):
+                (attrs['pk_name'], attrs['pk_index']) = (field.get_name(), i)
+                break
         new_class = super(DeclarativeFieldsMetaclass,
                      cls).__new__(cls, name, bases, attrs)
+        
+        # Solr fields to select for result listings, None for all of them.
+        # The primary key and model are always needed to build a document.
+        new_class.listing_fl = None
+        if new_class.listing_fields:
+            required = [f.get_name() for f in new_class.field_list
+                        if isinstance(f, (search_fields.PrimaryKeyField, search_fields.ModelField))]
+            listing = [new_class.base_fields[field_name].get_name() for field_name in new_class.listing_fields]
+            new_class.listing_fl = required + [n for n in listing if n not in required]
+        
+        # Resolve the transform_* and clean_* overrides once per class.  Each
+        # plan entry is (index, field, method), method is None for fields
+        # that rely on the field's own get_value or to_python.  Fields
+        # overriding the older transform or clean hooks go through those.
+        new_class.transform_plan = [(i, field, getattr(new_class, 'transform_%s' % field_name, None) or
+                                     get_legacy_method(i, field, 'transform'))
+                                    for i, (field_name, field) in enumerate(new_class.base_fields.items())]
+        new_class.clean_plan = [(i, field, getattr(new_class, 'clean_%s' % field_name, None) or
+                                 get_legacy_method(i, field, 'clean'))
+                                for i, (field_name, field) in enumerate(new_class.base_fields.items())]
         return new_class
 
 class BaseSearchDocument(object):
-    def __init__(self, model_or_dict):
+    # Model field holding the last modification time, used by the incremental
+    # reindex. Set it with Meta.timestamp_field.
+    timestamp_field = None
+    
+    # Solr name of the PrimaryKeyField, set by the metaclass
+    pk_name = None
+    
+    # Names of the fields result listings need, set with Meta.listing_fields.
+    # Only those are selected, the others are loaded when first read.
+    listing_fields = None
+    
+    # Applied to the queryset when results are turned back into model
+    # instances, see LazyDocuments.hydrate. Set with Meta.select_related
+    # (field names, or True for all) and Meta.prefetch_related.
+    select_related = None
+    prefetch_related = None
+    
+    # Called to load the deferred fields, set by the SelectResults the
+    # document came from so its documents are loaded together
+    _loader = None
+    
+    def __init__(self, model_or_dict, selected=None):
         """
         Takes a model or a dict.
         
@@ -120,10 +312,14 @@ class BaseSearchDocument(object):
         
         for a dict it assumes that you recieved results from solr and you want to make a 
         python object representation of the model    
-            
+        
+        selected are the fields the select asked for (see get_selected_fields),
+        None for all of them.  Only fields left out of it are loaded later,
+        a selected field missing from the dict is empty.
         """
-        self.fields = deepcopy(self.base_fields)
-        self.pk_field = None
+        self._values = [field.value for field in self.field_list]
+        self._selected = selected
+        self._highlights = None
         self._model = None
         self.data_dict = {}
         self.highlight = ""
@@ -138,20 +334,21 @@ class BaseSearchDocument(object):
         else:
             raise ValueError('Argument must be a Model or a dictionary')
         
-        # Iterate through fields and get value
-        for field in self.fields.values():
-            #Save value
-            if isinstance(field, search_fields.PrimaryKeyField):
-                self.pk_field = field
-                break
-        
-        if not self.pk_field:
+        if self.pk_index is None:
             raise NoPrimaryKeyFieldException('Search Document needs a Primary Key Field')
         
         if self._model:
             self.transform()
         else:
             self.clean()
+    
+    def _get_fields(self):
+        return BoundFields(self)
+    fields = property(_get_fields)
+    
+    def _get_pk_field(self):
+        return BoundField(self, self.pk_index)
+    pk_field = property(_get_pk_field)
         
     def transform(self):
         """
@@ -160,14 +357,14 @@ class BaseSearchDocument(object):
         if not self._model:
             raise ValueError('No model to transform into a Search Document')
         
-        for name, field in self.fields.items():
-            value = None
-            try:
-                value = getattr(self, 'transform_%s' % name)(self._model)
-                field.value = value
-            except AttributeError:
+        model = self._model
+        values = self._values
+        for i, field, method in self.transform_plan:
+            if method is None:
                 #no transform rely on the field
-                field.transform(self._model)
+                values[i] = field.get_value(model)
+            else:
+                values[i] = method(self, model)
     
     def clean(self):
         """
@@ -176,15 +373,53 @@ class BaseSearchDocument(object):
         if not self.data_dict:
             raise ValueError('No data to clean into a Search Document')
         
-        for name, field in self.fields.items():
-            value = None
-            field.value = self.data_dict[field.get_name()]
-            try:
-                value = getattr(self, 'clean_%s' % name, None)()
-                field.value = value
-            except:
-                #no transform rely on the field
-                field.clean()
+        self._clean()
+    
+    def _clean(self, deferred_only=False):
+        data_dict = self.data_dict
+        values = self._values
+        for i, field, method in self.clean_plan:
+            if deferred_only and values[i] is not DEFERRED:
+                continue
+            name = field.get_name()
+            if name not in data_dict:
+                # Solr leaves out empty and unstored fields, those are None.
+                # Fields the select didn't ask for are loaded by load_deferred.
+                if deferred_only or is_selected(name, self._selected):
+                    values[i] = None
+                else:
+                    values[i] = DEFERRED
+                continue
+            values[i] = data_dict[name]
+            if method is None:
+                #no clean rely on the field
+                values[i] = field.to_python(values[i])
+            else:
+                values[i] = method(self)
+    
+    def load_deferred(self):
+        """
+        Fetches the fields that were left out of the select, see
+        Meta.listing_fields.  Documents from a SelectResults load the missing
+        fields of all its documents with one select.  If the select fails
+        the missing fields are left empty.
+        """
+        if self._loader is not None:
+            self._loader(self)
+            return
+        
+        from solango import connection
+        id = self.data_dict[self.pk_name]
+        self.fill((connection.get_by_ids([id], self.pk_name) or {}).get(id, {}))
+    
+    def fill(self, data_dict):
+        """
+        Cleans the deferred fields from data_dict, the complete stored fields
+        of this document.
+        """
+        if data_dict is not self.data_dict:
+            self.data_dict.update(data_dict)
+        self._clean(deferred_only=True)
     
     def __unicode__(self):
         """
@@ -203,12 +438,16 @@ class BaseSearchDocument(object):
         if delete:
             return "<%s>%s</%s>" % (self.pk_field.name, self.pk_field.value, self.pk_field.name)
 
-        doc = unicode("", "utf-8")
+        if DEFERRED in self._values:
+            self.load_deferred()
+        
+        doc = [u"<doc>\n"]
         
-        for field in self.fields.values():
-            doc += unicode(field)
+        for field, value in zip(self.field_list, self._values):
+            doc.append(field.to_xml(value))
         
-        return "<doc>\n" + doc + "</doc>\n"
+        doc.append(u"</doc>\n")
+        return u"".join(doc)
 
     def render_html(self):
         return render_to_string(self.template, {'document' : self})
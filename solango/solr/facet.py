@@ -4,7 +4,32 @@
 
 from solango.solr import xmlutils
 from django.conf import settings
+from datetime import datetime
+from time import strptime
 import re
+
+DATE_RE = re.compile(r'^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(\.\d+)?Z$')
+NUMBER_RE = re.compile(r'^-?\d+$')
+FLOAT_RE = re.compile(r'^-?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$')
+
+def to_python(value):
+    """
+    Converts a bucket boundary returned by Solr, a date or a number written
+    as a string, into a datetime, int or float.  Anything else is returned
+    as it is.
+    """
+    if not isinstance(value, basestring):
+        return value
+    
+    m = DATE_RE.match(value)
+    if m:
+        return datetime(*strptime(m.group(1), "%Y-%m-%dT%H:%M:%S")[0:6])
+    if NUMBER_RE.match(value):
+        return int(value)
+    if FLOAT_RE.match(value):
+        return float(value)
+    return value
+
 class FacetValue(object):
     """
     An abstraction for a unique facet value count, returned from Solr.  This
@@ -51,10 +76,14 @@ class Facet(object):
     """
     (name, values) = (None, None)
     
-    def get_parent(self, value):
+    def get_parent(self, value, nodes=None):
         """
         Returns the best-fit immediate parent for the specified value, or
-        None if value does not appear to have a parent.
+        None if value does not appear to have a parent.  A missing parent is
+        created and appended to the values.
+        
+        nodes maps value strings to FacetValues; merge_values passes the one
+        it keeps up to date so the lookup does not scan the values.
         """
         n = value.value.rfind(settings.FACET_SEPARATOR)
         
@@ -63,15 +92,30 @@ class Facet(object):
         
         p = value.value[:n]
         
-        for v in self.values:
-            if v.value == p:
-                return v
+        if nodes is None:
+            nodes = self.get_nodes()
+        
+        f = nodes.get(p)
+        if f is not None:
+            return f
         
         f = FacetValue(p, 0)
         self.values.append(f)
+        nodes[p] = f
         
         return f
     
+    def get_nodes(self):
+        """
+        Returns a dictionary of this facet's values keyed by value string.
+        The first value wins if the same string appears twice.
+        """
+        nodes = {}
+        for v in self.values:
+            if v.value not in nodes:
+                nodes[v.value] = v
+        return nodes
+    
     def add_to_parent(self, parent, child):
         """
         Appends child to parent, recursing up the tree to increment the counts
@@ -109,9 +153,12 @@ class Facet(object):
         tree is used to produce a linear, sorted list of values.
         """
         values = []
+        nodes = self.get_nodes()
         
+        # get_parent appends missing parents to self.values, so they are
+        # merged in turn by this loop
         for v in self.values:
-            parent = self.get_parent(v)
+            parent = self.get_parent(v, nodes)
                     
             if not parent:
                 values.append(v)
@@ -125,7 +172,7 @@ class Facet(object):
             self.recurse_children(v)
     
     
-    def __init__(self, node):
+    def __init__(self, node=None):
         """
         Iterate the provided DOM Node, parsing the facet name and any child
         value counts.  Facet values are additionally merged into a tree
@@ -137,7 +184,12 @@ class Facet(object):
         
         Takes a parsed xml document.
         """
-        (self.name, self.values) = (xmlutils.get_attribute(node, "name"), [])
+        (self.name, self.values) = (None, [])
+        
+        if node is None:
+            return
+        
+        self.name = xmlutils.get_attribute(node, "name")
         
         for c in xmlutils.get_child_nodes(node, "int"):
             
@@ -147,5 +199,93 @@ class Facet(object):
             self.values.append(FacetValue(value, count))
         
         self.merge_values()
+    
+    @classmethod
+    def from_counts(cls, name, counts):
+        """
+        Builds a facet from a list of (value, count) pairs, for responses that
+        were not parsed into a DOM.
+        """
+        facet = cls()
+        facet.name = name
+        
+        for value, count in counts:
+            facet.values.append(FacetValue(value, int(count)))
+        
+        facet.merge_values()
+        return facet
 
-        
\ No newline at end of file
+        
+class QueryFacet(object):
+    """
+    The number of documents matching one facet.query, e.g. price:[0 TO 100]
+    """
+    def __init__(self, query, count=0):
+        (self.query, self.count) = (query, int(count))
+    
+    # Like FacetValue, so templates can treat both the same
+    value = property(lambda self: self.query)
+    name = property(lambda self: self.query)
+
+class RangeValue(object):
+    """
+    One bucket of a RangeFacet.  value is the bucket start as Solr returned
+    it, start and end are the typed boundaries.
+    """
+    def __init__(self, value, count=0, start=None, end=None):
+        (self.value, self.count) = (value, int(count))
+        (self.start, self.end) = (start, end)
+        self.name = value
+
+class RangeFacet(object):
+    """
+    The counts of a facet.date or facet.range field, one RangeValue per gap
+    in ascending order.  Each bucket ends where the next one starts and the
+    last one at end.  before, after and between are only set when
+    facet.date.other or facet.range.other asked for them.
+    
+    >>> facet = results.facet_dates[0]
+    >>> facet.name, facet.gap
+    (u'pub_date', u'+1YEAR')
+    >>> [(v.start.year, v.count) for v in facet.values]
+    [(2007, 5), (2008, 11)]
+    """
+    # Keys of a range section that are not buckets
+    OPTIONS = ('gap', 'start', 'end', 'before', 'after', 'between')
+    
+    def __init__(self, name, counts=(), gap=None, start=None, end=None,
+                 before=None, after=None, between=None):
+        (self.name, self.gap) = (name, gap)
+        (self.start, self.end) = (to_python(start), to_python(end))
+        (self.before, self.after, self.between) = (before, after, between)
+        
+        buckets = [(to_python(value), value, count) for value, count in counts]
+        buckets.sort()
+        
+        self.values = []
+        for i, (start, value, count) in enumerate(buckets):
+            if i + 1 < len(buckets):
+                end = buckets[i + 1][0]
+            else:
+                end = self.end
+            self.values.append(RangeValue(value, count, start, end))
+    
+    @classmethod
+    def from_pairs(cls, name, pairs, get_pairs=list):
+        """
+        Builds a range facet from the (key, value) pairs of its section in
+        facet_dates, where the buckets sit next to gap and end, or in
+        facet_ranges, where they are nested under counts.  get_pairs turns a
+        nested counts section into pairs.
+        """
+        (counts, options) = ([], {})
+        
+        for key, value in pairs:
+            if key == 'counts':
+                counts.extend(get_pairs(value))
+            elif key in cls.OPTIONS:
+                options[str(key)] = value
+            else:
+                counts.append((key, value))
+        
+        return cls(name, counts, **options)
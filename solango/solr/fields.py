@@ -7,7 +7,7 @@ from  datetime import datetime
 from time import strptime
 from django.utils.encoding import smart_unicode
 from django.conf import settings
-from solango.solr import get_model_key
+from solango.solr import get_model_key, get_document_id
 from solango.solr import utils
 
 class Field(object):
@@ -27,6 +27,9 @@ class Field(object):
     stored=true|false
         True if the value of the field should be retrievable during a search
     
+    The fields declared on a SearchDocument are shared by all its instances.
+    Documents keep their own values and hand out BoundFields, so subclasses
+    compute values in get_value and to_python instead of setting self.value.
     """
     # Tracks each time a Field instance is created. Used to retain order.
     creation_counter = 0
@@ -56,7 +59,13 @@ class Field(object):
             self.value = unicode(re.sub(r"<[^>]*?>", "", value), "utf-8")
         
     def __unicode__(self):
-        return '<field name="%s"><![CDATA[%s]]></field>\n' % (self.get_name(), utils._from_python(self.value))
+        return self.to_xml(self.value)
+    
+    def to_xml(self, value):
+        """
+        Returns the Solr field element for value.
+        """
+        return '<field name="%s"><![CDATA[%s]]></field>\n' % (self.get_name(), utils._from_python(value))
                 
     def dynamic_name(self):
         return "%s_%s" % (self.name, self.dynamic_suffix)
@@ -68,11 +77,16 @@ class Field(object):
             return self.name
     
     def transform(self, model):
-        try:
-            self.value = getattr(model, self.name)
-        except AttributeError, e:
-            #not all fields like 'text' will have a transform.
-            pass
+        self.value = self.get_value(model)
+    
+    def get_value(self, model):
+        """
+        Returns the value of this field for a model instance.  Fields are
+        shared by all documents of a class, so this must not store anything
+        on the field.
+        """
+        #not all fields like 'text' will have a transform, keep the default.
+        return getattr(model, self.name, self.value)
     
     def _config(self):
         """
@@ -86,11 +100,15 @@ class Field(object):
         return '<copyField source="%s" dest="%s"/>' % (self.name, self.dest)
     
     def clean(self):
+        self.value = self.to_python(self.value)
+    
+    def to_python(self, value):
         """
         If the transform messed up the data this is a way of getting it back to normal
         """
-        if isinstance(self.value, list):
-            self.value = ' '.join(self.value)
+        if isinstance(value, list):
+            value = ' '.join(value)
+        return value
     
     def highlighting(self, limit=100):
         """
@@ -107,67 +125,64 @@ class DateField(Field):
     dynamic_suffix = "dt"
     type = "date"
     
-    def clean(self):
-        self.value = datetime(*strptime(self.value, "%Y-%m-%dT%H:%M:%SZ")[0:6]).date()
+    def to_python(self, value):
+        return datetime(*strptime(value, "%Y-%m-%dT%H:%M:%SZ")[0:6]).date()
     
 class DateTimeField(Field):
     dynamic_suffix = "dt"
     type = "date"
 
-    def clean(self):
-        self.value = datetime(*strptime(self.value, "%Y-%m-%dT%H:%M:%SZ")[0:6])
+    def to_python(self, value):
+        return datetime(*strptime(value, "%Y-%m-%dT%H:%M:%SZ")[0:6])
 
 class CharField(Field):
     dynamic_suffix = "s"
     type = "string"
     
-    def clean(self):
-        super(CharField, self).clean()
-        self.value = unicode(self.value)
+    def to_python(self, value):
+        return unicode(super(CharField, self).to_python(value))
 
 class TextField(Field):
     dynamic_suffix = "t"
     type="text"
     
-    def clean(self):
-        super(TextField, self).clean()
-        self.value = unicode(self.value)
+    def to_python(self, value):
+        return unicode(super(TextField, self).to_python(value))
 
 class SolrTextField(Field):
     dynamic_suffix = "t"
     type="text"
     
-    def clean(self):
-        super(SolrTextField, self).clean()
-        self.value = unicode(self.value)
+    def to_python(self, value):
+        return unicode(super(SolrTextField, self).to_python(value))
     
-    def transform(self, model):
-        pass
+    def get_value(self, model):
+        return self.value
 
 class IntegerField(Field):
     dynamic_suffix = "i"
     type = "integer"
     
-    def clean(self):
-        self.value = int(self.value)
+    def to_python(self, value):
+        return int(value)
 
 class BooleanField(Field):
     dynamic_suffix = "b"
     
-    def clean(self):
-        if self.value == 'true':
-            self.value = True
-        elif self.value == 'false':
-            self.value = False
+    def to_python(self, value):
+        if value == 'true':
+            return True
+        elif value == 'false':
+            return False
+        return value
             
 class UrlField(CharField):
     
     def __init__(self, *args, **kwargs):
         super(UrlField, self).__init__(name='url', *args, **kwargs)
     
-    def transform(self, model):
-        self.value = model.get_absolute_url()
-        return unicode(self)
+    def get_value(self, model):
+        return model.get_absolute_url()
 
 class PrimaryKeyField(CharField):
     
@@ -175,27 +190,24 @@ class PrimaryKeyField(CharField):
         kwargs.update({'required' : True})
         super(PrimaryKeyField, self).__init__(*args, **kwargs)
         
-    def transform(self, model):
+    def get_value(self, model):
         """
         Returns a unique identifier string for the specified object.
         
         This avoids duplicate documents
         """
-        self.value =  "%s%s%s" % (get_model_key(model), settings.SEARCH_SEPARATOR, model.pk)
-        
-        return unicode(self)
+        return get_document_id(model, model.pk)
     
-    def clean(self):
-        self.value = self.value.split(settings.SEARCH_SEPARATOR)[-1]
+    def to_python(self, value):
+        return value.split(settings.SEARCH_SEPARATOR)[-1]
 
 class SiteField(IntegerField):
     def __init__(self, *args, **kwargs):
         kwargs.update({'required' : True})
         super(SiteField, self).__init__( *args, **kwargs)
 
-    def transform(self, value_or_model):
-        self.value = settings.SITE_ID
-        return unicode(self)
+    def get_value(self, value_or_model):
+        return settings.SITE_ID
 
 class ModelField(CharField):
    
@@ -203,22 +215,21 @@ class ModelField(CharField):
         kwargs.update({'required' : True})
         super(ModelField, self).__init__(name='id', *args, **kwargs)
 
-    def transform(self, value_or_model):
-        self.value = get_model_key(value_or_model)
-        return unicode(self)
+    def get_value(self, value_or_model):
+        return get_model_key(value_or_model)
 
 ## May not be too useful, but the dynamic fields exist in solr, so use'em
 class FloatField(Field):
     dynamic_suffix = "f"
     
-    def clean(self):
-        self.value = float(self.value)
+    def to_python(self, value):
+        return float(value)
 
 class DoubleField(Field):
     dynamic_suffix = "d"
     
-    def clean(self):
-        self.value = float(self.value)
+    def to_python(self, value):
+        return float(value)
         
 class LongField(Field):
     dynamic_suffix = "l"
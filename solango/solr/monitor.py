@@ -0,0 +1,149 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Background health monitoring of the Solr nodes.
+
+A daemon thread pings every URL in SEARCH_PING_URLS with a short timeout and
+keeps the health and latency of each node in memory, so
+SearchWrapper.is_available never has to wait on the network.
+"""
+
+from datetime import datetime
+import os
+import threading
+import time
+import urlparse
+
+from django.utils.datastructures import SortedDict
+from solango.log import logger
+
+class NodeStatus(object):
+    """
+    Last known state of a single Solr node.
+
+    url      -- The ping URL of the node
+    healthy  -- True or False, None until the node has been checked
+    latency  -- Duration of the last ping in seconds
+    checked  -- datetime of the last ping
+    failures -- Number of consecutive failed pings
+    error    -- The error of the last failed ping
+    """
+    def __init__(self, url):
+        self.url = url
+        self.host = urlparse.urlparse(url)[1]
+        (self.healthy, self.latency, self.checked) = (None, None, None)
+        (self.failures, self.error) = (0, None)
+
+class HealthMonitor(object):
+    """
+    Pings each node every ``interval`` seconds, giving up on a node after
+    ``timeout`` seconds.  Changes in health are reported through the logger.
+
+    The pinging thread belongs to the process that started it.  A forked
+    child inherits the monitor but not the thread, so ensure_started starts
+    a new one whenever the process id changes.
+    """
+    def __init__(self, pool, urls, interval=30, timeout=2):
+        (self.pool, self.interval, self.timeout) = (pool, interval, timeout)
+        self.nodes = SortedDict([(url, NodeStatus(url)) for url in urls])
+        self._finished = threading.Event()
+        self._start_lock = threading.Lock()
+        # Process the thread was started in, None until it is
+        (self._thread, self._pid, self._lock_pid) = (None, None, os.getpid())
+
+    def ping(self, node):
+        """
+        Pings a single node and updates its status.
+        """
+        started = time.time()
+        try:
+            self.pool.request(node.url, timeout=self.timeout)
+        except StandardError, e:
+            (healthy, node.error) = (False, e)
+            node.failures += 1
+        else:
+            (healthy, node.error) = (True, None)
+            node.failures = 0
+
+        (node.latency, node.checked) = (time.time() - started, datetime.now())
+
+        if healthy != node.healthy:
+            if healthy:
+                logger.info("Solr node %s is up (%.3fs)" % (node.url, node.latency))
+            else:
+                logger.warning("Solr node %s is down: %s" % (node.url, node.error))
+        node.healthy = healthy
+
+    def check(self):
+        """
+        Pings every node once.
+        """
+        for node in self.nodes.values():
+            self.ping(node)
+
+    def run(self):
+        while not self._finished.isSet():
+            self.check()
+            self._finished.wait(self.interval)
+
+    def ensure_started(self):
+        """
+        Starts the monitor thread if it isn't running in this process yet.
+        The first check is done synchronously so callers get a real answer
+        straight away.
+        """
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+
+        if self._lock_pid != pid:
+            # Forked, the lock may have been copied while another thread held it
+            (self._start_lock, self._lock_pid) = (threading.Lock(), pid)
+
+        self._start_lock.acquire()
+        try:
+            if self._pid != pid:
+                self.check()
+                self._thread = threading.Thread(target=self.run, name="solango-health-monitor")
+                self._thread.setDaemon(True)
+                self._thread.start()
+                self._pid = pid
+        finally:
+            self._start_lock.release()
+
+    def stop(self):
+        """
+        Stops the monitor thread after the current check.
+        """
+        self._finished.set()
+
+    def is_healthy(self, url):
+        """
+        Returns the last known health of the node with the specified ping URL.
+        """
+        return bool(self.nodes[url].healthy)
+
+    def get_health(self, url):
+        """
+        Returns the last known health of the node url (e.g. a select or
+        update URL) lives on, found by matching its host to a ping URL.  If no
+        ping URL is on that host the health of every node, available, is all
+        there is to go by.
+        """
+        host = urlparse.urlparse(url)[1]
+        for node in self.nodes.values():
+            if node.host == host:
+                return bool(node.healthy)
+        return self.available
+
+    @property
+    def available(self):
+        """
+        True if every node answered its last ping.
+        """
+        for node in self.nodes.values():
+            if not node.healthy:
+                return False
+        return True
@@ -0,0 +1,278 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+A small, thread-safe pool of persistent HTTP/1.1 connections.
+
+Every request to Solr used to open a fresh socket through urllib2.  The pool
+keeps idle connections around per (host, port), so selects, updates and pings
+reuse the same TCP connection instead of paying for a handshake and leaving
+sockets in TIME_WAIT.
+
+>>> pool = HTTPConnectionPool(size=4, timeout=10)
+>>> (status, body) = pool.request("http://localhost:8983/solr/admin/ping")
+"""
+
+import errno
+import httplib
+import socket
+import threading
+import time
+import urlparse
+
+class RequestError(StandardError):
+    """
+    Base class for errors raised by the pool.
+    """
+    pass
+
+class ConnectionError(RequestError):
+    """
+    The connection to the server failed or was dropped.  Nothing is known
+    about whether the server processed the request.
+    """
+    pass
+
+class HTTPError(RequestError):
+    """
+    The server answered with an error status (>= 400).
+    """
+    def __init__(self, url, status, reason, body=None):
+        RequestError.__init__(self, "HTTP Error %s: %s (%s)" % (status, reason, url))
+        (self.url, self.status, self.reason, self.body) = (url, status, reason, body)
+
+class HTTPConnectionPool(object):
+    """
+    Keeps up to ``size`` idle keep-alive connections per host.
+
+    size     -- Maximum number of idle connections kept per host.  Requests
+        never block on the pool; if every connection is busy a new one is
+        opened and closed again if the pool is full when it is returned.
+    timeout  -- Socket timeout in seconds, None for no timeout.
+    max_idle -- Connections idle for longer than this many seconds are
+        considered stale and are closed instead of reused.
+    """
+
+    def __init__(self, size=4, timeout=None, max_idle=60):
+        (self.size, self.timeout, self.max_idle) = (size, timeout, max_idle)
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _split(self, url):
+        """
+        Returns (host, port, path) for the specified http URL.
+        """
+        (scheme, netloc, path, params, query, fragment) = urlparse.urlparse(url)
+
+        if scheme != "http":
+            raise ValueError("Only http URLs are supported: %s" % url)
+
+        if ":" in netloc:
+            (host, port) = netloc.split(":", 1)
+            port = int(port)
+        else:
+            (host, port) = (netloc, httplib.HTTP_PORT)
+
+        if params:
+            path += ";" + params
+        if query:
+            path += "?" + query
+
+        return (host, port, path or "/")
+
+    def _get(self, key):
+        """
+        Returns a connection for key, reusing a healthy idle one if possible.
+        The second element of the returned tuple is True if the connection
+        was reused.
+        """
+        now = time.time()
+
+        self._lock.acquire()
+        try:
+            idle = self._idle.get(key, [])
+            while idle:
+                (conn, last_used) = idle.pop()
+                if conn.sock is not None and now - last_used <= self.max_idle:
+                    return (conn, True)
+                # Stale, the server has most likely dropped it already.
+                conn.close()
+        finally:
+            self._lock.release()
+
+        return (httplib.HTTPConnection(key[0], key[1], timeout=self.timeout), False)
+
+    def _put(self, key, conn):
+        """
+        Returns conn to the pool, closing it if the pool is full.
+        """
+        self._lock.acquire()
+        try:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.size:
+                idle.append((conn, time.time()))
+                return
+        finally:
+            self._lock.release()
+
+        conn.close()
+
+    def _send(self, conn, method, path, body, headers, timeout):
+        """
+        Issues a single request on conn and returns the response, ready to be
+        read.  A body that is not a string is sent with chunked transfer
+        encoding, one chunk per string it yields.
+
+        The timeout is set on every request, a pooled connection must not keep
+        the timeout of whoever used it last (e.g. the health monitor's ping).
+        """
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+
+        if body is None or isinstance(body, str):
+            conn.request(method, path, body, headers)
+        else:
+            conn.putrequest(method, path)
+            for key, value in headers.items():
+                conn.putheader(key, value)
+            conn.putheader("Transfer-Encoding", "chunked")
+            conn.endheaders()
+            for chunk in body:
+                if chunk:
+                    conn.send("%x\r\n%s\r\n" % (len(chunk), chunk))
+            conn.send("0\r\n\r\n")
+
+        return conn.getresponse()
+
+    def _open(self, url, body, headers, timeout):
+        """
+        Sends the request and returns (key, conn, response) once the response
+        headers have arrived.
+
+        A reused connection the server has already closed is retried once on
+        a fresh connection.  Only failures which show the server never read
+        the request are retried (see is_stale_error), so commits, optimizes
+        and deletes are not replayed after a timeout.  Iterable bodies must
+        be iterable more than once (not a bare generator).
+        """
+        (host, port, path) = self._split(url)
+        key = (host, port)
+        method = body is None and "GET" or "POST"
+        headers = dict(headers or {})
+
+        if timeout is None:
+            timeout = self.timeout
+
+        retried = False
+        while True:
+            (conn, reused) = self._get(key)
+            try:
+                response = self._send(conn, method, path, body, headers, timeout)
+            except (socket.error, httplib.HTTPException), e:
+                conn.close()
+                if reused and not retried and is_stale_error(e):
+                    retried = True
+                    continue
+                raise ConnectionError("%s (%s)" % (e, url))
+            except:
+                conn.close()
+                raise
+            return (key, conn, response)
+
+    def _release(self, key, conn, response):
+        """
+        Returns conn to the pool if response was read to the end and the
+        server keeps the connection open, closes it otherwise.
+        """
+        if response.will_close or not response.isclosed():
+            conn.close()
+        else:
+            self._put(key, conn)
+
+    def request(self, url, body=None, headers=None, timeout=None):
+        """
+        Submits body to url, POSTing if there is a body and GETting otherwise.
+        body is either a string or an iterable of strings which is streamed
+        chunk by chunk.  Returns (status, body) or raises ConnectionError or
+        HTTPError.
+        """
+        (key, conn, response) = self._open(url, body, headers, timeout)
+
+        try:
+            data = response.read()
+        except (socket.error, httplib.HTTPException), e:
+            conn.close()
+            raise ConnectionError("%s (%s)" % (e, url))
+
+        self._release(key, conn, response)
+
+        if response.status >= 400:
+            raise HTTPError(url, response.status, response.reason, data)
+
+        return (response.status, data)
+
+    def urlopen(self, url, timeout=None):
+        """
+        GETs url and returns a file-like PooledResponse to read the body from
+        as it arrives.  The connection goes back to the pool when the response
+        is closed after being read to the end.
+        """
+        (key, conn, response) = self._open(url, None, None, timeout)
+
+        if response.status >= 400:
+            data = response.read()
+            self._release(key, conn, response)
+            raise HTTPError(url, response.status, response.reason, data)
+
+        return PooledResponse(self, key, conn, response)
+
+    def clear(self):
+        """
+        Closes every idle connection.
+        """
+        self._lock.acquire()
+        try:
+            (idle, self._idle) = (self._idle, {})
+        finally:
+            self._lock.release()
+
+        for connections in idle.values():
+            for (conn, last_used) in connections:
+                conn.close()
+
+def is_stale_error(e):
+    """
+    Returns True if e shows a kept-alive connection was closed by the server
+    before it read the request: the connection was reset or the server
+    answered with nothing at all.  Timeouts are never stale, the server may
+    still be working on the request.
+    """
+    if isinstance(e, socket.timeout):
+        return False
+    if isinstance(e, httplib.BadStatusLine):
+        return True
+    return isinstance(e, socket.error) and \
+        e.errno in (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+class PooledResponse(object):
+    """
+    A streamed response body.  Always close it, ideally after reading it to
+    the end, so the connection can be reused.
+    """
+    def __init__(self, pool, key, conn, response):
+        (self.pool, self.key, self.conn, self.response) = (pool, key, conn, response)
+        self.status = response.status
+
+    def read(self, amt=None):
+        try:
+            return self.response.read(amt)
+        except (socket.error, httplib.HTTPException), e:
+            self.conn.close()
+            raise ConnectionError(str(e))
+
+    def close(self):
+        if self.conn is not None:
+            self.pool._release(self.key, self.conn, self.response)
+            self.conn = None
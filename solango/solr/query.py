@@ -21,30 +21,113 @@ from solango.solr.query import Query
 """
 from solango.solr import utils
 from solango.solr.utils import CleverDict
+from solango.log import logger
 from django.conf import settings
+import re
 import urllib
 
+# Parameters that may be turned into filters, they end up as field names and
+# in {!tag=...} local params
+FILTER_KEY_RE = re.compile(r'^\w+$')
+
+# Characters with a meaning in the Lucene query syntax, whitespace included
+LUCENE_SPECIAL_RE = re.compile(r'([+\-&|!(){}\[\]^"~*?:\\/\s])')
+
+def escape_value(value):
+    """
+    Returns value with the Lucene special characters backslash escaped, so it
+    is matched as a single term.
+    """
+    return LUCENE_SPECIAL_RE.sub(r'\\\1', '%s' % value)
+
+# SEARCH_FILTER_FIELDS when it is not set, as in initial_settings
+DEFAULT_FILTER_FIELDS = {
+    "model": "model:%(value)s",
+    "site_id": "site_id:%(value)s",
+}
+
+def get_filter_fields():
+    """
+    Returns SEARCH_FILTER_FIELDS as a dictionary of parameter name to filter
+    query template, where %(value)s stands for the requested value.  The
+    setting may also just list parameter names, filtered as name:value.
+    """
+    filter_fields = getattr(settings, 'SEARCH_FILTER_FIELDS', DEFAULT_FILTER_FIELDS)
+    if isinstance(filter_fields, dict):
+        return filter_fields
+    return dict([(name, '%s:%%(value)s' % name) for name in filter_fields])
+
+def is_per_field(key, name):
+    """
+    Returns True for a per field override of a name parameter, e.g.
+    f.pub_date.facet.date.gap for facet.
+    """
+    bits = key.split('.')
+    return len(bits) > 3 and bits[0] == 'f' and bits[2] == name
+
+class FacetRange(CleverDict):
+    """
+    The facet.date or facet.range parameters. fields lists the fields to
+    facet on, the other keys are shared by them:
+        start, end, gap
+        hardend, other, include
+    
+    >>> q.facet.date.fields.append('pub_date')
+    >>> q.facet.date.start = 'NOW/YEAR-5YEARS'
+    >>> q.facet.date.end = 'NOW'
+    >>> q.facet.date.gap = '+1YEAR'
+    """
+    def __init__(self, *args, **kwargs):
+        dict.__setattr__(self, 'fields', [])
+        CleverDict.__init__(self, *args, **kwargs)
+    
+    def items(self):
+        return [(self._name, field) for field in self.fields] + CleverDict.items(self)
+    
+    def clean(self, *args):
+        if args and isinstance(args[0], list):
+            for key, value in args[0]:
+                if key != self._name:
+                    continue
+                if isinstance(value, (list, tuple)):
+                    self.fields.extend(value)
+                else:
+                    self.fields.append(value)
+        CleverDict.clean(self, *args)
 
 class Facet(CleverDict):
     """
     Python class representation of solr's facet capibilites
     
-    Date faceting has not been implemented
-    
     by default solr assumes
         self.sort = False
         self.offset = 0
         self.limit = 100
         self.mincount = 0
         self.missing = None 
+    
+    Besides field facets it handles facet.query, one count per query, and
+    date and range faceting, see FacetRange.  Per field parameters, like
+    f.pub_date.facet.date.gap, are kept in per_field and sent as they are.
     """
     def __init__(self, *args, **kwargs):
         #if initial data exists then we parse it out and put it in the right fields
         # expects a list of tuples. Facets shouldn't be built directly, only of queries
         # Standard Fields
         self.field = []
-        self.queries = []
+        self.query = []
+        self.date = FacetRange(instance='date')
+        self.range = FacetRange(instance='range')
+        dict.__setattr__(self, 'per_field', [])
         CleverDict.__init__(self, *args, **kwargs)
+    
+    def items(self):
+        return CleverDict.items(self) + [(key, utils._from_python(value)) for key, value in self.per_field]
+    
+    def clean(self, *args):
+        if args and isinstance(args[0], list):
+            self.per_field.extend([(key, value) for key, value in args[0] if is_per_field(key, self._name)])
+        CleverDict.clean(self, *args)
 
     @property    
     def url(self):
@@ -124,6 +207,8 @@ class Query(dict):
         self.fl = []
         self.start = 0
         self.rows = 10
+        # Set to * or a nextCursorMark for cursor paging, see SearchPaginator
+        self.cursorMark = ''
         self.clean(*args, **kwargs)
 
     #So we can do url.url
@@ -161,10 +246,12 @@ class Query(dict):
         if not params:
             return None
         
-        facet_params = settings.SEARCH_FACET_PARAMS
-        hl_params = settings.SEARCH_HL_PARAMS
+        # Copies, the defaults must not collect the params of every query
+        facet_params = list(settings.SEARCH_FACET_PARAMS)
+        hl_params = list(settings.SEARCH_HL_PARAMS)
+        filters = []
         for key, value in params:
-            if key.startswith('facet'):
+            if key.startswith('facet') or is_per_field(key, 'facet'):
                 facet_params.append((key, value),)
             elif key.startswith('hl'):
                 hl_params.append((key, value),)
@@ -172,14 +259,65 @@ class Query(dict):
                 try:
                     v = self[key]
                     if isinstance(v, list):
-                        self[key].append(value)
+                        if isinstance(value, (list, tuple)):
+                            v.extend(value)
+                        else:
+                            v.append(value)
                     else:
                         self[key] = value
                 except KeyError:
-                    self.q.append('%s:%s' % (key, value))
+                    filters.append((key, value))
         
         self.facet = Facet(facet_params, instance='facet')
         self.hl = Highlight(hl_params, instance='hl')
+        
+        for key, value in filters:
+            self.add_filter(key, value)
+    
+    def add_filter(self, key, value):
+        """
+        Restricts the query to documents where parameter key matches value, a
+        value or a list of values any of which may match.
+        
+        Parameters listed in SEARCH_FILTER_FIELDS go into their own fq, which
+        Solr caches in its filterCache independently of q and which does not
+        change the scores.  The clause comes from the template of the
+        parameter, e.g. {'year': 'date:[%(value)s-01-01T00:00:00Z TO
+        %(value)s-12-31T23:59:59Z]'}.  Anything else is ANDed into q as
+        key:value.
+        
+        A filter on a faceted field goes into fq, tagged with the field name,
+        and the facet excludes that tag.  So the facet still counts the other
+        values of the field and a single select has everything a multi-select
+        facet navigation needs.  Set SEARCH_FACET_MULTISELECT to False to
+        treat faceted fields like any other.
+        
+        Values are escaped, they come from the query string.  A key which is
+        not a plain field name is logged and ignored.
+        """
+        if not FILTER_KEY_RE.match(key):
+            logger.warning("add_filter: Ignoring invalid parameter %r" % key)
+            return
+        
+        filter_fields = get_filter_fields()
+        template = filter_fields.get(key) or '%s:%%(value)s' % key
+        
+        if isinstance(value, (list, tuple)):
+            clause = '(%s)' % ' OR '.join([template % {'value': escape_value(v)} for v in value])
+        else:
+            clause = template % {'value': escape_value(value)}
+        
+        excluded = '{!ex=%s}%s' % (key, key)
+        faceted = key in self.facet.field or excluded in self.facet.field
+        
+        if faceted and getattr(settings, 'SEARCH_FACET_MULTISELECT', True):
+            self.fq.append('{!tag=%s}%s' % (key, clause))
+            if key in self.facet.field:
+                self.facet.field[self.facet.field.index(key)] = excluded
+        elif key in filter_fields:
+            self.fq.append(clause)
+        else:
+            self.q.append(clause)
 
     @property
     def url(self):
@@ -192,12 +330,19 @@ class Query(dict):
                 params.append( ('q', ' AND '.join(self.q)), )
                 q = True
             elif key == 'sort':
-                params.append( ('sort', ' '.join(value)), )
+                params.append( ('sort', ','.join(value)), )
+            elif key == 'fq':
+                params.extend([('fq', v) for v in value])
             elif isinstance(value, list):
                 params.append( (key, ', '.join([x for x in value])), )
             else:
                 params.append( (key, value), )
 
+        if not q and self.fq:
+            # Only filters, match everything they let through
+            params.append( ('q', '*:*'), )
+            q = True
+        
         if not q:
             return ''
                 
@@ -2,14 +2,23 @@
 # Copyright 2008 Optaros, Inc.
 #
 
+from cStringIO import StringIO
 from xml.dom import minidom
+from xml.sax import make_parser
+from xml.sax.handler import ContentHandler
+from django.utils import simplejson
 from solango.solr import xmlutils
-from solango.solr.facet import Facet
+from solango.solr.facet import Facet, QueryFacet, RangeFacet
 from solango.log import logger
 from django.conf import settings 
+from django.utils.datastructures import SortedDict
 from solango import registry
+import re
 import urllib
 
+# Local params in front of a facet param, e.g. {!ex=model}model
+LOCAL_PARAMS_RE = re.compile(r'^\{![^}]*\}')
+
 class Results:
     """
     Results instances parse Solr response XML into Python objects.  A Solr
@@ -34,12 +43,34 @@ class Results:
         </doc>
       </result>
       <lst name="facet_counts">
+        <lst name="facet_queries">
+          <int name="price:[0 TO 100]">4</int>
+          ...
+        </lst>
         <lst name="facet_fields">
           <lst name="some field">
             <int name="some value">2</int>
             ...
           </lst>
         </lst>
+        <lst name="facet_dates">
+          <lst name="some date field">
+            <int name="2008-01-01T00:00:00Z">5</int>
+            ...
+            <str name="gap">+1YEAR</str>
+            <date name="end">2009-01-01T00:00:00Z</date>
+          </lst>
+        </lst>
+        <lst name="facet_ranges">
+          <lst name="some numeric field">
+            <lst name="counts">
+              <int name="0">3</int>
+              ...
+            </lst>
+            <int name="gap">100</int>
+            ...
+          </lst>
+        </lst>
       </lst>
       <lst name="highlighting">
         <lst name="document_id">
@@ -76,10 +107,22 @@ class Results:
         if not xml:
             raise ValueError, "Invalid or missing XML"
         
-        self._doc = minidom.parseString(xml)
+        self._load(xml)
         
         self._parse_header()
     
+    def _load(self, xml):
+        """
+        Parses the raw response.
+        """
+        self._doc = minidom.parseString(xml)
+    
+    def _release(self):
+        """
+        Frees the parsed response once everything has been read from it.
+        """
+        self._doc.unlink()
+    
     @property
     def status(self):
         """
@@ -112,7 +155,7 @@ class UpdateResults(Results):
     def __init__(self, xml):
         Results.__init__(self, xml)
         
-        self._doc.unlink()
+        self._release()
     
 class SelectResults(Results):
     """
@@ -120,6 +163,10 @@ class SelectResults(Results):
     """
     
     (count, documents, facets, highlighting) = (None, None, None, None)
+    (facet_queries, facet_dates, facet_ranges) = (None, None, None)
+    
+    # Where the next page starts when the select was made with a cursorMark
+    next_cursor_mark = None
     
     def __init__(self, xml):
         """
@@ -128,7 +175,8 @@ class SelectResults(Results):
         """
         Results.__init__(self, xml)
         
-        (self.documents, self.facets, self.highlighting) = ([], [], {})
+        (self.documents, self.facets, self.highlighting) = (LazyDocuments(), [], {})
+        (self.facet_queries, self.facet_dates, self.facet_ranges) = ([], [], [])
         
         self._parse_results()
         
@@ -136,13 +184,24 @@ class SelectResults(Results):
         
         self._parse_highlighting()
         
-        self._doc.unlink()
+        self._parse_cursor()
+        
+        self._release()
         
     def _parse_header(self):
         Results._parse_header(self)
         self.rows = int(self.header['params']['rows'])
         self.start = int(self.header['params']['start'])
     
+    def _parse_cursor(self):
+        """
+        Reads the nextCursorMark of a select made with a cursorMark.
+        """
+        node = xmlutils.get_child_node(self._doc.firstChild, "str", "nextCursorMark")
+        
+        if node:
+            self.next_cursor_mark = xmlutils.get_unicode(node)
+    
     def _get_result_node(self):
         """
         Returns the result Node from this Result's DOM tree.
@@ -152,7 +211,8 @@ class SelectResults(Results):
     def _parse_results(self):
         """
         Parse the results array into the documents list.  Each resulting
-        document element is a dictionary. 
+        document element is a dictionary, turned into a SearchDocument when
+        it is first accessed.
         """
         result = self._get_result_node()
         
@@ -162,13 +222,18 @@ class SelectResults(Results):
         self.count = int(xmlutils.get_attribute(result, "numFound"))
         
         for d in xmlutils.get_child_nodes(result, "doc"):
-            data_dict = xmlutils.get_dictionary(d)
-            document = registry[data_dict['model']](data_dict)
-            self.documents.append(document)
+            self._add_document(xmlutils.get_dictionary(d))
+    
+    def _add_document(self, data_dict):
+        """
+        Adds a raw result dictionary to the documents.
+        """
+        self.documents.append(data_dict)
         
     def _parse_facets(self):
         """
-        Parses the facet counts into this Result's facets list.
+        Parses the facet counts into this Result's facets, facet_queries,
+        facet_dates and facet_ranges lists.
         """
         result = self._get_result_node()
         facets =  xmlutils.get_sibling_node(result, "lst", "facet_counts")
@@ -176,13 +241,56 @@ class SelectResults(Results):
         if not facets:
             return None
         
-        fields = xmlutils.get_child_node(facets, "lst", "facet_fields")
-
-        if not fields:
-            return None
-
-        for facet in xmlutils.get_child_nodes(fields, "lst"):
-            self.facets.append(Facet(facet))
+        self._parse_facet_counts(xmlutils.get_pairs(facets))
+    
+    def _get_pairs(self, value):
+        """
+        Returns a named list of the facet_counts section as (name, value)
+        pairs.  The XML parsers already produce pairs.
+        """
+        return value
+    
+    def _parse_facet_counts(self, facet_counts):
+        """
+        Builds the facets from the facet_counts section, given as nested
+        (name, value) pairs.
+        """
+        for section, value in self._get_pairs(facet_counts):
+            if section == "facet_fields":
+                for name, counts in self._get_pairs(value):
+                    self._add_facet(name, self._get_pairs(counts))
+            elif section == "facet_queries":
+                for query, count in self._get_pairs(value):
+                    self.facet_queries.append(QueryFacet(query, count))
+            elif section == "facet_dates":
+                for name, pairs in self._get_pairs(value):
+                    self.facet_dates.append(RangeFacet.from_pairs(name, self._get_pairs(pairs), self._get_pairs))
+            elif section == "facet_ranges":
+                for name, pairs in self._get_pairs(value):
+                    self.facet_ranges.append(RangeFacet.from_pairs(name, self._get_pairs(pairs), self._get_pairs))
+        
+        # Keep the order the facets were asked in, JSON objects lose it
+        self._sort_by_params(self.facets, 'facet.field', lambda f: f.name)
+        self._sort_by_params(self.facet_queries, 'facet.query', lambda f: f.query)
+        self._sort_by_params(self.facet_dates, 'facet.date', lambda f: f.name)
+        self._sort_by_params(self.facet_ranges, 'facet.range', lambda f: f.name)
+    
+    def _sort_by_params(self, facets, param, get_key):
+        """
+        Sorts facets in the order of the param values echoed in the header,
+        leaving out local params such as {!ex=model}.
+        """
+        order = self.header['params'].get(param, [])
+        if isinstance(order, basestring):
+            order = [order]
+        order = dict([(LOCAL_PARAMS_RE.sub('', value), i) for i, value in enumerate(order)])
+        facets.sort(key=lambda f: order.get(get_key(f), len(order)))
+    
+    def _add_facet(self, name, counts):
+        """
+        Appends the facet for field name, built from its (value, count) pairs.
+        """
+        self.facets.append(Facet.from_counts(name, counts))
         
     def _parse_highlighting(self):
         """
@@ -196,9 +304,346 @@ class SelectResults(Results):
             return
         
         self.highlighting = xmlutils.get_dictionary(highlighting)
-        for d in self.documents:
-            #TODO: Ugly
-            model_key = settings.SEARCH_SEPARATOR.join([d.fields['model'].value, d.pk_field.value])
-            for key, value in self.highlighting[model_key].items():
-                d.highlight += ' ' + ' '.join(value)
-                d.fields[key].highlight = ' '.join(value)
\ No newline at end of file
+        self._attach_highlighting()
+    
+    def _attach_highlighting(self):
+        """
+        Hands the highlighting snippets to the documents, which copy them onto
+        each document as it is built.
+        """
+        self.documents.highlighting = self.highlighting
+
+class LazyDocuments(object):
+    """
+    The documents of a SelectResults.  The raw field dictionaries returned by
+    Solr are kept and the registered SearchDocument is only built, and
+    highlighted, when a document is indexed or iterated.  Callers that only
+    need ids or a few field values can use ids, pks and values instead.
+    """
+    
+    def __init__(self):
+        (self._raw, self._documents, self.highlighting) = ([], [], {})
+        self._loaded = False
+        # Fields the select asked for, None for all, see set_fl
+        self.selected = None
+    
+    def set_fl(self, fl):
+        """
+        Records the fl params of the select, so only the fields it left out
+        are loaded when read.
+        """
+        from solango.solr.documents import get_selected_fields
+        self.selected = get_selected_fields(fl)
+    
+    def append(self, data_dict):
+        self._raw.append(data_dict)
+        self._documents.append(None)
+    
+    def __len__(self):
+        return len(self._raw)
+    
+    def __nonzero__(self):
+        return bool(self._raw)
+    
+    def __iter__(self):
+        for i in range(len(self._raw)):
+            yield self[i]
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self._raw)))]
+        
+        document = self._documents[i]
+        if document is None:
+            document = self._documents[i] = self._build(self._raw[i])
+        return document
+    
+    def _build(self, data_dict):
+        document = registry[data_dict['model']](data_dict, self.selected)
+        document._loader = self.load
+        
+        for key, value in self.highlighting.get(self._get_id(data_dict), {}).items():
+            document.highlight += ' ' + ' '.join(value)
+            document.fields[key].highlight = ' '.join(value)
+        
+        return document
+    
+    def _get_id(self, data_dict):
+        return data_dict[registry[data_dict['model']].pk_name]
+    
+    def load(self, document=None):
+        """
+        Fetches the fields left out of the select (see Meta.listing_fields)
+        for all documents with one select by id, and fills them in on the
+        documents built so far.  Documents built later start out complete.
+        If the select fails the missing fields are left empty, it is not
+        retried for every field read.
+        """
+        if not self._loaded and self._raw:
+            from solango import connection
+            ids = self.ids()
+            found = connection.get_by_ids(ids, registry[self._raw[0]['model']].pk_name)
+            if found is None:
+                logger.error("load: Deferred fields of %d documents left empty" % len(ids))
+                found = {}
+            for id, data_dict in zip(ids, self._raw):
+                for key, value in found.get(id, {}).items():
+                    data_dict.setdefault(key, value)
+            self._loaded = True
+        
+        for data_dict, built in zip(self._raw, self._documents):
+            if built is not None:
+                built.fill(data_dict)
+    
+    def hydrate(self, cached=None):
+        """
+        Returns the model instances of the documents, in the order Solr
+        returned them.  Each model is loaded with one query, applying the
+        select_related and prefetch_related of its document's Meta, so a page
+        costs the same number of queries whatever its size.
+        
+        cached is a dictionary of instances already at hand keyed by Solr id,
+        e.g. cache.get_many(results.documents.ids()); those are not loaded
+        again.  Documents whose object no longer exists are left out.
+        """
+        from solango.solr import get_model_from_key, get_document_id
+        
+        ids = self.ids()
+        instances = dict(cached or {})
+        
+        pks = SortedDict()
+        for id, data_dict in zip(ids, self._raw):
+            if id not in instances:
+                pks.setdefault(data_dict['model'], []).append(id.split(settings.SEARCH_SEPARATOR)[-1])
+        
+        for model_key, model_pks in pks.items():
+            document = registry[model_key]
+            queryset = get_model_from_key(model_key)._default_manager.filter(pk__in=model_pks)
+            if document.select_related is True:
+                queryset = queryset.select_related()
+            elif document.select_related:
+                queryset = queryset.select_related(*document.select_related)
+            if document.prefetch_related:
+                queryset = queryset.prefetch_related(*document.prefetch_related)
+            
+            for instance in queryset:
+                instances[get_document_id(model_key, instance.pk)] = instance
+        
+        return [instances[id] for id in ids if id in instances]
+    
+    def raw(self, i):
+        """
+        Returns the field dictionary of the i-th document as Solr returned it.
+        """
+        return self._raw[i]
+    
+    def ids(self):
+        """
+        Returns the Solr ids of the documents, e.g. blog__entry__1
+        """
+        return [self._get_id(d) for d in self._raw]
+    
+    def pks(self):
+        """
+        Returns the model primary keys of the documents, as strings.
+        """
+        return [id.split(settings.SEARCH_SEPARATOR)[-1] for id in self.ids()]
+    
+    def values(self, name, default=None):
+        """
+        Returns the raw value of field name for every document.  Fields left
+        out of the select are default until load has been called.
+        """
+        return [d.get(name, default) for d in self._raw]
+
+def get_pairs(value):
+    """
+    Returns a named list from a JSON response as a list of (name, value)
+    pairs, whichever json.nl style it was written in.
+    """
+    if isinstance(value, dict):
+        return value.items()
+    if value and isinstance(value[0], list):
+        return [tuple(pair) for pair in value]
+    return zip(value[::2], value[1::2])
+
+class JSONSelectResults(SelectResults):
+    """
+    Results for Solr select requests made with wt=json, exposing the same
+    interface as SelectResults without building a DOM.
+    
+    See http://wiki.apache.org/solr/SolJSON
+    """
+    
+    def _load(self, body):
+        self._data = simplejson.loads(body)
+    
+    def _release(self):
+        del self._data
+    
+    def _parse_header(self):
+        if "responseHeader" not in self._data:
+            raise ValueError, "Results contained no header."
+        
+        self.header = self._data["responseHeader"]
+        if isinstance(self.header.get('params'), list):
+            self.header['params'] = dict(get_pairs(self.header['params']))
+        self.rows = int(self.header['params']['rows'])
+        self.start = int(self.header['params']['start'])
+    
+    def _parse_results(self):
+        result = self._data.get("response")
+        
+        if result is None:
+            raise ValueError, "Results contained no result."
+        
+        self.count = int(result["numFound"])
+        
+        for data_dict in result["docs"]:
+            self._add_document(data_dict)
+    
+    def _parse_facets(self):
+        facet_counts = self._data.get("facet_counts")
+        
+        if not facet_counts:
+            return None
+        
+        self._parse_facet_counts(facet_counts)
+    
+    def _get_pairs(self, value):
+        return get_pairs(value)
+    
+    def _parse_highlighting(self):
+        self.highlighting = self._data.get("highlighting")
+        
+        if not self.highlighting:
+            self.highlighting = {}
+            return
+        
+        self._attach_highlighting()
+    
+    def _parse_cursor(self):
+        self.next_cursor_mark = self._data.get("nextCursorMark")
+
+class SelectHandler(ContentHandler):
+    """
+    SAX handler feeding a StreamingSelectResults as the response is read.
+    Values are parsed the way xmlutils.get_dictionary and get_list parse
+    them; documents and facets are handed over as soon as they are complete.
+    """
+    # Element types xmlutils knows how to read, anything else is skipped
+    SCALARS = ("str", "int", "long", "float", "double", "bool", "date")
+    CONTAINERS = ("lst", "arr", "doc")
+    
+    def __init__(self, results):
+        ContentHandler.__init__(self)
+        self.results = results
+        # Each frame is [tag, name, value, in_facets]
+        self.stack = []
+        self.skip = 0
+    
+    def startElement(self, tag, attrs):
+        if self.skip:
+            self.skip += 1
+            return
+        
+        name = attrs.get("name")
+        depth = len(self.stack)
+        
+        if depth == 0:
+            self.stack.append([tag, None, None, False])
+        elif depth == 1 and tag == "result":
+            self.results.count = int(attrs.get("numFound"))
+            self.stack.append([tag, name, None, False])
+        elif tag in self.SCALARS:
+            self.stack.append([tag, name, [], False])
+        elif tag in self.CONTAINERS:
+            parent = self.stack[-1]
+            in_facets = parent[3] or (depth == 1 and name == "facet_counts")
+            self.stack.append([tag, name, [], in_facets])
+        else:
+            self.skip = 1
+    
+    def characters(self, content):
+        if not self.skip and self.stack and self.stack[-1][0] in self.SCALARS:
+            self.stack[-1][2].append(content)
+    
+    def endElement(self, tag):
+        if self.skip:
+            self.skip -= 1
+            return
+        
+        (tag, name, value, in_facets) = self.stack.pop()
+        
+        if not self.stack or tag == "result":
+            return
+        
+        if tag in ("int", "long"):
+            value = int(u"".join(value))
+        elif tag in ("float", "double"):
+            value = float(u"".join(value))
+        elif tag == "bool":
+            value = u"".join(value) == u"true"
+        elif tag in self.SCALARS:
+            value = u"".join(value)
+        elif tag in ("lst", "doc") and not in_facets:
+            value = dict(value)
+        
+        parent = self.stack[-1]
+        
+        if parent[0] == "result":
+            self.results._add_document(value)
+        elif len(self.stack) == 1:
+            if name == "responseHeader":
+                self.results.header = value
+            elif name == "facet_counts":
+                self.results._parse_facet_counts(value)
+            elif name == "highlighting":
+                self.results.highlighting = value
+            elif name == "nextCursorMark":
+                self.results.next_cursor_mark = value
+        elif parent[0] == "arr":
+            parent[2].append(value)
+        else:
+            parent[2].append((name, value))
+
+class StreamingSelectResults(SelectResults):
+    """
+    Results for Solr select requests, parsed with SAX straight from the
+    response stream.  No DOM is built and the response never has to be held
+    in memory as a whole; documents, facets and highlighting are the same as
+    those of SelectResults.
+    
+    Takes either the response body or a file-like object to read it from.
+    """
+    
+    def __init__(self, source):
+        if not source:
+            raise ValueError, "Invalid or missing XML"
+        
+        (self.documents, self.facets, self.highlighting) = (LazyDocuments(), [], {})
+        (self.facet_queries, self.facet_dates, self.facet_ranges) = ([], [], [])
+        
+        self._load(source)
+        
+        if not self.header:
+            raise ValueError, "Results contained no header."
+        if self.count is None:
+            raise ValueError, "Results contained no result."
+        
+        self._parse_header()
+        self._attach_highlighting()
+    
+    def _load(self, source):
+        if isinstance(source, unicode):
+            source = source.encode("utf-8")
+        if isinstance(source, str):
+            source = StringIO(source)
+        
+        parser = make_parser()
+        parser.setContentHandler(SelectHandler(self))
+        parser.parse(source)
+    
+    def _parse_header(self):
+        self.rows = int(self.header['params']['rows'])
+        self.start = int(self.header['params']['start'])
@@ -58,9 +58,12 @@ class CleverDict(dict):
                 try:
                     v = self[bits[1]]
                     if isinstance(v, list):
-                        self[bits[1]].append(value)
+                        if isinstance(value, (list, tuple)):
+                            v.extend(value)
+                        else:
+                            v.append(value)
                     elif isinstance(v, CleverDict):
-                        self[bits[1]][bits[2]] = value
+                        v.clean([('.'.join(bits[1:]), value)])
                     else:
                         self[bits[1]] = value
                 except KeyError:
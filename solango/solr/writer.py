@@ -0,0 +1,239 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Buffered, coalescing index writer.
+
+The post_save and post_delete signal handlers normally send one add or delete
+to Solr per saved row.  When buffering is turned on the documents are
+collected per thread instead, repeated saves of the same object are coalesced
+and everything is sent as a single <add> and a single <delete> when the
+buffer is flushed.
+
+The buffer is flushed when:
+
+* it reaches ``size`` pending documents,
+* the request ends (see solango.middleware.BufferedIndexMiddleware),
+* a function wrapped with ``buffered`` returns,
+* a transaction managed by ``commit_on_success`` commits,
+* ``flush`` is called explicitly, or
+* the interpreter exits, for the main thread only.
+
+Code running outside a request in threads of its own (task queue workers,
+custom threads) must call ``flush`` or use ``buffered``, anything left in
+such a thread's buffer is lost.  Django has no hook for a transaction
+commit, so a transaction committed by hand with ``transaction.commit()``
+must be followed by ``flush``.  A batch Solr did not take is kept and sent
+again with the next flush.
+
+>>> from solango import indexer
+>>> indexer.add(document)
+>>> indexer.delete(other_document)
+>>> indexer.flush()
+>>> indexer.stats
+{'flushes': 1, 'added': 1, 'deleted': 1, 'coalesced': 0, 'failed': 0, 'pending': 0, 'max_pending': 2}
+"""
+
+import threading
+
+from django.utils.datastructures import SortedDict
+from solango.log import logger
+
+(DELETE, ADD) = (0, 1)
+
+class BufferedWriter(object):
+    """
+    Collects adds and deletes per thread and sends them to ``connection`` in
+    batches.
+
+    connection -- The SearchWrapper the batches are sent to.
+    size       -- Number of pending documents which triggers a flush.
+    """
+
+    def __init__(self, connection, size=500):
+        (self.connection, self.size) = (connection, size)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = {'flushes': 0, 'added': 0, 'deleted': 0, 'coalesced': 0,
+                       'failed': 0, 'max_pending': 0}
+
+    def _get_pending(self):
+        """
+        Returns this thread's pending documents, keyed by document id.
+        """
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            pending = self._local.pending = SortedDict()
+        return pending
+
+    def _record(self, **counts):
+        self._lock.acquire()
+        try:
+            for key, value in counts.items():
+                self._stats[key] += value
+        finally:
+            self._lock.release()
+
+    def _queue(self, mode, document):
+        """
+        Queues document, replacing anything already pending for the same id.
+        The last operation on an id wins.
+        """
+        pending = self._get_pending()
+        if isinstance(document, basestring):
+            key = document
+        else:
+            key = document.pk_field.value
+
+        if key in pending:
+            # SortedDict keeps the original position, move it to the end so
+            # the batch order follows the order of the last change.
+            del pending[key]
+            self._record(coalesced=1)
+
+        pending[key] = (mode, document)
+
+        self._lock.acquire()
+        try:
+            if len(pending) > self._stats['max_pending']:
+                self._stats['max_pending'] = len(pending)
+        finally:
+            self._lock.release()
+
+        if len(pending) >= self.size:
+            self.flush()
+
+    def add(self, document):
+        """
+        Queues document to be added (or updated) in the index.
+        """
+        self._queue(ADD, document)
+
+    def delete(self, document):
+        """
+        Queues a document, or just its Solr id, to be deleted from the index.
+        """
+        self._queue(DELETE, document)
+
+    def _send(self, mode, batch):
+        """
+        Sends a batch of (key, (mode, document)) pairs, all in the same mode.
+        Returns True if Solr took it.
+        """
+        try:
+            if mode == ADD:
+                res = self.connection.add([document for (key, (m, document)) in batch])
+            else:
+                res = self.connection.delete_by_id([key for (key, entry) in batch])
+        except StandardError, e:
+            logger.error("flush: %s" % e)
+            return False
+
+        if not res:
+            logger.error("flush: Search is unavailable, %d documents kept" % len(batch))
+        return bool(res)
+
+    def flush(self):
+        """
+        Sends this thread's pending documents to Solr, one batch for adds and
+        one for deletes.  A batch which fails is put back in the buffer, in
+        front of anything queued since.  Returns the number of documents sent.
+        """
+        pending = self._get_pending()
+
+        if not pending:
+            return 0
+
+        self._local.pending = SortedDict()
+
+        (adds, deletes) = ([], [])
+        for key, entry in pending.items():
+            if entry[0] == ADD:
+                adds.append((key, entry))
+            else:
+                deletes.append((key, entry))
+
+        (sent, failed) = ({ADD: 0, DELETE: 0}, [])
+        for (mode, batch) in ((ADD, adds), (DELETE, deletes)):
+            if not batch:
+                continue
+            if self._send(mode, batch):
+                sent[mode] = len(batch)
+            else:
+                failed.extend(batch)
+
+        if failed:
+            self._requeue(failed)
+
+        self._record(flushes=1, added=sent[ADD], deleted=sent[DELETE],
+                     failed=len(failed))
+
+        return sent[ADD] + sent[DELETE]
+
+    def _requeue(self, failed):
+        """
+        Puts the failed (key, entry) pairs back in front of this thread's
+        buffer.  Anything queued for the same id since wins.
+        """
+        pending = SortedDict()
+        for key, entry in failed:
+            pending[key] = entry
+        for key, entry in self._get_pending().items():
+            if key in pending:
+                del pending[key]
+            pending[key] = entry
+        self._local.pending = pending
+
+    def discard(self):
+        """
+        Drops this thread's pending documents without sending them, e.g.
+        after a rolled back transaction.
+        """
+        self._local.pending = SortedDict()
+
+    @property
+    def pending(self):
+        """
+        Number of documents waiting in this thread's buffer.
+        """
+        return len(self._get_pending())
+
+    @property
+    def stats(self):
+        """
+        Returns a dictionary of flush and size statistics across all threads.
+        """
+        self._lock.acquire()
+        try:
+            stats = dict(self._stats)
+        finally:
+            self._lock.release()
+        stats['pending'] = self.pending
+        return stats
+
+    def buffered(self, func):
+        """
+        Decorator which flushes the buffer when func returns and discards it if
+        func raises, so a view or a transaction sends its changes as one batch.
+        """
+        def _buffered(*args, **kwargs):
+            try:
+                res = func(*args, **kwargs)
+            except:
+                self.discard()
+                raise
+            self.flush()
+            return res
+        _buffered.__name__ = func.__name__
+        _buffered.__doc__ = func.__doc__
+        return _buffered
+
+    def commit_on_success(self, func):
+        """
+        Decorator working like django.db.transaction.commit_on_success which
+        flushes the buffer once the transaction is committed and discards it
+        if the transaction is rolled back.
+        """
+        from django.db import transaction
+        return self.buffered(transaction.commit_on_success(func))
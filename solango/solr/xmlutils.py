@@ -17,12 +17,14 @@ def get_list(node):
     
     for c in node.childNodes:
         if c.nodeType == Node.ELEMENT_NODE:
-            if c.localName == "str":
+            if c.localName in ("str", "date"):
                 ret.append(get_unicode(c))
-            elif c.localName == "int":
+            elif c.localName in ("int", "long"):
                 ret.append(get_int(c))
-            elif c.localName == "date":
-                ret.append(c)
+            elif c.localName in ("float", "double"):
+                ret.append(get_float(c))
+            elif c.localName == "bool":
+                ret.append(get_unicode(c) == "true")
             elif c.localName == "arr":
                 ret.append(get_list(c))
             elif c.localName == "lst":
@@ -32,6 +34,34 @@ def get_list(node):
     
     return ret       
 
+def get_pairs(node):
+    """
+    Parses the specified Solr XML lst element into an ordered list of
+    (name, value) pairs.  Nested lst elements become pair lists as well,
+    numbers and booleans are converted.
+    """
+    ret = []
+    
+    for c in node.childNodes:
+        if c.nodeType == Node.ELEMENT_NODE:
+            
+            name = get_attribute(c, "name")
+            
+            if c.localName in ("str", "date"):
+                ret.append((name, get_unicode(c)))
+            elif c.localName in ("int", "long"):
+                ret.append((name, get_int(c)))
+            elif c.localName in ("float", "double"):
+                ret.append((name, get_float(c)))
+            elif c.localName == "bool":
+                ret.append((name, get_unicode(c) == "true"))
+            elif c.localName == "arr":
+                ret.append((name, get_list(c)))
+            elif c.localName == "lst":
+                ret.append((name, get_pairs(c)))
+    
+    return ret
+
 def get_dictionary(node):
     """
     Parses the specified Solr XML lst element into a dictionary.
@@ -43,12 +73,14 @@ def get_dictionary(node):
             
             name = c.attributes.item(0).value
             
-            if c.localName == "str":
+            if c.localName in ("str", "date"):
                 ret[name] = get_unicode(c)
-            elif c.localName == "int":
+            elif c.localName in ("int", "long"):
                 ret[name] = get_int(c)
-            elif c.localName == "date":
-                ret[name] = get_unicode(c)
+            elif c.localName in ("float", "double"):
+                ret[name] = get_float(c)
+            elif c.localName == "bool":
+                ret[name] = get_unicode(c) == "true"
             elif c.localName == "arr":
                 ret[name] = get_list(c)
             elif c.localName == "lst":
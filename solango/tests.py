@@ -0,0 +1,918 @@
+#
+# Copyright 2008 Optaros, Inc.
+#
+
+"""
+Unit tests for solango.  None of them need a running Solr or a database.
+
+    ./manage.py test solango
+"""
+
+import cgi
+from cStringIO import StringIO
+from datetime import date, datetime
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from django.core.paginator import InvalidPage
+
+import solango
+from solango import indexing, paginator
+from solango.solr import cache, connection, results
+from solango.solr.monitor import HealthMonitor
+from solango.solr.query import Query
+from solango.solr.writer import BufferedWriter
+
+class Row(object):
+    def __init__(self, pk, modified):
+        (self.pk, self.modified) = (pk, modified)
+
+class RowQuerySet(object):
+    """
+    Just enough of a QuerySet for iter_changed_chunks on its first chunk.
+    """
+    def __init__(self, rows):
+        self.rows = rows
+
+    def filter(self, *args, **kwargs):
+        rows = self.rows
+        if kwargs.get('modified__isnull') is False:
+            rows = [row for row in rows if row.modified is not None]
+        return RowQuerySet(rows)
+
+    def order_by(self, *fields):
+        return RowQuerySet(sorted(self.rows, key=lambda row: (row.modified, row.pk)))
+
+    def __getitem__(self, k):
+        return self.rows[k]
+
+class PkQuerySet(object):
+    """
+    Just enough of a QuerySet for iter_chunks and get_shards, over a list of
+    primary keys.
+    """
+    def __init__(self, pks):
+        self.pks = sorted(pks)
+        self.queries = 0
+
+    def all(self):
+        return self
+
+    def order_by(self, *fields):
+        return self
+
+    def count(self):
+        return len(self.pks)
+
+    def filter(self, pk__gt=None, pk__gte=None, pk__lte=None):
+        pks = self.pks
+        if pk__gt is not None:
+            pks = [pk for pk in pks if pk > pk__gt]
+        if pk__gte is not None:
+            pks = [pk for pk in pks if pk__gte <= pk <= pk__lte]
+        return PkQuerySet(pks)
+
+    def aggregate(self, low, high):
+        return {'low': self.pks and self.pks[0] or None,
+                'high': self.pks and self.pks[-1] or None}
+
+    def __getitem__(self, k):
+        return [Row(pk, None) for pk in self.pks[k]]
+
+class PkModel(object):
+    """
+    A model class stand-in whose objects are the given primary keys.
+    """
+    class _meta:
+        class pk:
+            name = 'id'
+
+    def __init__(self, pks):
+        self.objects = PkQuerySet(pks)
+
+class ChunkTest(unittest.TestCase):
+
+    def chunks(self, pks, size):
+        return [[row.pk for row in chunk] for chunk in indexing.iter_chunks(PkQuerySet(pks), size)]
+
+    def test_every_row(self):
+        pks = [1, 2, 3, 7, 8, 20, 21, 22, 40, 99]
+        for size in (1, 3, 5, 10, 11):
+            chunks = self.chunks(pks, size)
+            self.assertEqual(sum(chunks, []), pks)
+            self.failIf([chunk for chunk in chunks if not 0 < len(chunk) <= size])
+
+    def test_empty(self):
+        self.assertEqual(self.chunks([], 10), [])
+
+class ReindexTest(unittest.TestCase):
+
+    def setUp(self):
+        import solango.solr
+        self.saved = (solango.registry.copy(), solango.solr.get_model_from_key)
+        self.model = PkModel(range(1, 11))
+        solango.registry.clear()
+        solango.registry['blog__entry'] = lambda row: PendingDocument(row.pk)
+        solango.solr.get_model_from_key = lambda key: self.model
+
+        (self.batches, self.commits, self.lock) = ([], [], threading.Lock())
+        def add(documents, commit=True):
+            self.lock.acquire()
+            try:
+                self.batches.append([d.pk_field.value for d in documents])
+            finally:
+                self.lock.release()
+            # Solr refuses the batch holding pk 5
+            return 5 not in self.batches[-1] and [True, None] or None
+        solango.connection.add = add
+        solango.connection.commit = lambda: self.commits.append(True)
+
+    def tearDown(self):
+        import solango.solr
+        del solango.connection.add
+        del solango.connection.commit
+        solango.registry.clear()
+        solango.registry.update(self.saved[0])
+        solango.solr.get_model_from_key = self.saved[1]
+
+    def test_threaded(self):
+        progress = []
+        (stats,) = indexing.reindex(workers=3, batch_size=4, progress=progress.append)
+        self.assertEqual(sorted(self.batches), [[1, 2, 3, 4], [5, 6, 7, 8], [9, 10]])
+        self.assertEqual((stats.total, stats.sent, stats.errors, stats.batches), (10, 6, 4, 3))
+        self.failUnless(stats.finished)
+        self.assertEqual(progress[-1], stats)
+        self.assertEqual(self.commits, [True])
+
+class FakePool(object):
+    """
+    Stands in for the multiprocessing module and its Pool, returning canned
+    index_shard results.
+    """
+    def __init__(self, results):
+        self.results = results
+
+    def Pool(self, processes, initializer):
+        return self
+
+    def imap_unordered(self, func, shards):
+        return [self.results.pop(0) for shard in shards]
+
+    def close(self):
+        pass
+
+    def join(self):
+        pass
+
+class ShardedReindexTest(unittest.TestCase):
+
+    def test_get_shards(self):
+        self.assertEqual(indexing.get_shards(PkModel(range(1, 11)), 4),
+                         [(1, 3), (4, 6), (7, 9), (10, 10)])
+        self.assertEqual(indexing.get_shards(PkModel(range(1, 13)), 4),
+                         [(1, 3), (4, 6), (7, 9), (10, 12)])
+        self.assertEqual(indexing.get_shards(PkModel([5, 6]), 4), [(5, 5), (6, 6)])
+        self.assertEqual(indexing.get_shards(PkModel([]), 4), [])
+
+    def test_get_shards_non_int_pk(self):
+        self.assertEqual(indexing.get_shards(PkModel(['a', 'b', 'c']), 4), [(None, None)])
+
+    def test_time_per_model(self):
+        import solango.solr
+        models = {'blog__entry': PkModel([1, 2]), 'blog__link': PkModel(['a'])}
+        saved = (solango.registry.copy(), solango.solr.get_model_from_key, indexing.multiprocessing)
+        solango.registry.clear()
+        solango.registry.update(dict([(key, None) for key in models.keys()]))
+        solango.solr.get_model_from_key = models.get
+        indexing.multiprocessing = FakePool([
+            (('blog__entry', 1, 1, 100), 1, 0, None, None, (100.0, 104.0)),
+            (('blog__link', None, None, 100), 1, 0, None, None, (101.0, 102.0)),
+            (('blog__entry', 2, 2, 100), 1, 0, None, None, (102.0, 106.0))])
+        solango.connection.commit = lambda: None
+        try:
+            report = dict([(stats.model_key, stats) for stats in indexing.reindex_sharded(processes=1)])
+        finally:
+            solango.registry.clear()
+            solango.registry.update(saved[0])
+            (solango.solr.get_model_from_key, indexing.multiprocessing) = saved[1:]
+            del solango.connection.commit
+
+        self.assertEqual((report['blog__entry'].sent, report['blog__entry'].elapsed), (2, 6.0))
+        self.assertEqual((report['blog__link'].sent, report['blog__link'].elapsed), (1, 1.0))
+
+class IncrementalReindexTest(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.path) = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(self.path)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def round_trip(self, timestamp):
+        indexing.CheckpointStore(self.path).set('blog__entry', timestamp, 7)
+        return indexing.CheckpointStore(self.path).get('blog__entry')
+
+    def test_checkpoint_round_trip(self):
+        for timestamp in (date(2008, 5, 1), datetime(2008, 5, 1, 12, 30, 15),
+                          datetime(2008, 5, 1, 12, 30, 15, 2500)):
+            self.assertEqual(self.round_trip(timestamp), (timestamp, 7))
+
+    def test_checkpoint_timezone(self):
+        for minutes in (0, 120, -330):
+            timestamp = datetime(2008, 5, 1, 12, 30, 15, 2500, indexing.FixedOffset(minutes))
+            (value, pk) = self.round_trip(timestamp)
+            self.assertEqual(value, timestamp)
+            self.assertEqual(value.utcoffset(), timestamp.utcoffset())
+
+    def test_null_timestamps_skipped(self):
+        rows = [Row(1, datetime(2008, 5, 1)), Row(2, None), Row(3, datetime(2008, 5, 2))]
+        chunks = list(indexing.iter_changed_chunks(RowQuerySet(rows), 'modified', None, 10))
+        self.assertEqual([[row.pk for row in chunk] for chunk in chunks], [[1, 3]])
+
+class UpperCharField(solango.fields.CharField):
+    """
+    A field written against the old hooks, which set self.value.
+    """
+    def transform(self, model):
+        self.value = getattr(model, self.name).upper()
+
+    def clean(self):
+        value = self.value
+        # Give other threads a chance to step on a shared field
+        time.sleep(0.001)
+        self.value = value.upper()
+
+class LegacyDocument(solango.SearchDocument):
+    title = UpperCharField()
+
+class Options(object):
+    (app_label, module_name) = ('blog', 'entry')
+
+class Entry(object):
+    (pk, title, _meta) = (1, 'abc', Options())
+
+    def get_absolute_url(self):
+        return '/blog/1/'
+
+class LegacyFieldTest(unittest.TestCase):
+
+    def test_transform_override(self):
+        document = LegacyDocument({'id': 'blog__entry__1'})
+        document._model = Entry()
+        document.transform()
+        self.assertEqual(document.fields['title'].value, 'ABC')
+        self.failUnless('ABC' in document.to_xml())
+        self.assertEqual(LegacyDocument.base_fields['title'].value, None)
+
+    def test_clean_override(self):
+        document = LegacyDocument({'id': 'blog__entry__1', 'title': 'abc'})
+        self.assertEqual(document.fields['title'].value, 'ABC')
+        self.assertEqual(LegacyDocument.base_fields['title'].value, None)
+
+    def test_concurrent_calls(self):
+        cleaned = {}
+        def clean(title):
+            cleaned[title] = LegacyDocument({'id': 'blog__entry__1', 'title': title}).fields['title'].value
+        threads = [threading.Thread(target=clean, args=('title %d' % i,)) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(cleaned, dict([(title, title.upper()) for title in cleaned.keys()]))
+        self.assertEqual(len(cleaned), 20)
+
+SELECT_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<response>
+<lst name="responseHeader"><int name="status">0</int><int name="QTime">1</int>
+<lst name="params"><str name="rows">10</str><str name="start">0</str></lst></lst>
+<result name="response" numFound="1" start="0">
+<doc><str name="id">blog__entry__1</str><str name="model">blog__entry</str><str name="title">abc</str></doc>
+</result>
+</response>"""
+
+class ListingDocument(solango.SearchDocument):
+    title = solango.fields.CharField()
+    body = solango.fields.TextField()
+
+    class Meta:
+        listing_fields = ('title',)
+
+class DeferredFieldTest(unittest.TestCase):
+
+    def setUp(self):
+        solango.registry['blog__entry'] = ListingDocument
+        self.requested = []
+        def get_by_ids(ids, key='id'):
+            self.requested.append(ids)
+            return {'blog__entry__1': {'body': 'text'}}
+        solango.connection.get_by_ids = get_by_ids
+
+    def tearDown(self):
+        del solango.connection.get_by_ids
+        del solango.registry['blog__entry']
+
+    def select(self, fl):
+        res = results.SelectResults(SELECT_RESPONSE)
+        res.documents.set_fl(fl)
+        return res.documents[0]
+
+    def test_empty_field_on_full_select(self):
+        for fl in ([], ['*'], ['*,score']):
+            document = self.select(fl)
+            self.assertEqual(document.fields['body'].value, None)
+            self.assertEqual(document.fields['title'].value, 'abc')
+        self.assertEqual(self.requested, [])
+
+    def test_field_left_out_of_fl(self):
+        document = self.select(['id', 'model', 'title'])
+        self.assertEqual(document.fields['body'].value, 'text')
+        self.assertEqual(document.fields['url'].value, None)
+        self.assertEqual(self.requested, [['blog__entry__1']])
+
+    def test_failed_fetch(self):
+        def get_by_ids(ids, key='id'):
+            self.requested.append(ids)
+            return None
+        solango.connection.get_by_ids = get_by_ids
+        document = self.select(['id', 'model', 'title'])
+        self.assertEqual(document.fields['body'].value, None)
+        self.assertEqual(document.fields['url'].value, None)
+        self.assertEqual(self.requested, [['blog__entry__1']])
+
+    def test_select_leaves_query(self):
+        solango.connection.issue_select = lambda query_string, parse=None: SELECT_RESPONSE
+        try:
+            query = Query({'q': 'django'})
+            res = solango.connection.select(query)
+        finally:
+            del solango.connection.issue_select
+        self.assertEqual(query.fl, [])
+        self.failIf(res.documents.selected is None)
+
+UPDATE_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<response>
+<lst name="responseHeader"><int name="status">0</int><int name="QTime">1</int></lst>
+</response>"""
+
+class FakeMonitor(HealthMonitor):
+    """
+    A monitor with a fixed health per ping URL and no thread.
+    """
+    def __init__(self, health):
+        HealthMonitor.__init__(self, None, health.keys())
+        for url, healthy in health.items():
+            self.nodes[url].healthy = healthy
+
+    def ensure_started(self):
+        pass
+
+class UpdateTestCase(unittest.TestCase):
+    """
+    Points solango.connection at fake nodes and records what it sends.
+    """
+
+    def setUp(self):
+        self.saved = dict([(name, getattr(solango.connection, name))
+                           for name in ('monitor', 'update_url', 'select_urls')])
+        solango.connection.update_url = 'http://master:8983/solr/update'
+        solango.connection.select_urls = ['http://replica1:8983/solr/select',
+                                          'http://replica2:8983/solr/select']
+        self.sent = []
+        def update(content):
+            self.sent.append(unicode(content))
+            return UPDATE_RESPONSE
+        solango.connection.update = update
+
+    def tearDown(self):
+        del solango.connection.update
+        for name, value in self.saved.items():
+            setattr(solango.connection, name, value)
+
+class AvailabilityTest(UpdateTestCase):
+
+    def set_health(self, master, replica1, replica2):
+        solango.connection.monitor = FakeMonitor({
+            'http://master:8983/solr/admin/ping': master,
+            'http://replica1:8983/solr/admin/ping': replica1,
+            'http://replica2:8983/solr/admin/ping': replica2})
+
+    def test_replica_down(self):
+        self.set_health(True, False, True)
+        self.failUnless(solango.connection.is_available())
+        self.failUnless(solango.connection.delete_by_id(['blog__entry__1'], commit=False))
+        self.assertEqual(len(self.sent), 1)
+        self.failUnless('<id>blog__entry__1</id>' in self.sent[0])
+
+    def test_master_down(self):
+        self.set_health(False, True, True)
+        self.failUnless(solango.connection.is_available())
+        self.assertEqual(solango.connection.delete_by_id(['blog__entry__1'], commit=False), None)
+        self.assertEqual(self.sent, [])
+
+    def test_replicas_down(self):
+        self.set_health(True, False, False)
+        self.failIf(solango.connection.is_available())
+        self.failUnless(solango.connection.is_update_available())
+
+class DeleteTest(UpdateTestCase):
+
+    def setUp(self):
+        UpdateTestCase.setUp(self)
+        solango.connection.monitor = FakeMonitor({'http://master:8983/solr/admin/ping': True})
+
+    def body(self):
+        self.assertEqual(len(self.sent), 1)
+        return self.sent[0].strip()
+
+    def test_by_id(self):
+        solango.connection.delete_by_id(['blog__entry__1', 'a<b&c'], commit=False)
+        self.assertEqual(self.body(), '<delete>\n<id>blog__entry__1</id>\n<id>a&lt;b&amp;c</id>\n</delete>')
+
+    def test_by_pk(self):
+        solango.connection.delete_by_pk(Entry, [1, 2], commit=False)
+        self.assertEqual(self.body(), '<delete>\n<id>blog__entry__1</id>\n<id>blog__entry__2</id>\n</delete>')
+
+    def test_by_query(self):
+        solango.connection.delete_by_query('title:"a & b" AND price:[* TO 10]', commit=False)
+        self.assertEqual(self.body(),
+                         '<delete>\n<query>title:"a &amp; b" AND price:[* TO 10]</query>\n</delete>')
+
+    def test_model_and_site(self):
+        solango.connection.delete_model('blog__entry', site_id='2', commit=False)
+        self.failUnless('<query>model:"blog__entry" AND site_id:2</query>' in self.body())
+        self.sent = []
+        solango.connection.delete_site(3, commit=False)
+        self.failUnless('<query>site_id:3</query>' in self.body())
+
+    def test_empty(self):
+        self.assertRaises(ValueError, solango.connection.delete_by_id, [])
+        self.assertRaises(ValueError, solango.connection.delete_by_query, '')
+
+class CommitPolicyTest(UpdateTestCase):
+
+    def setUp(self):
+        UpdateTestCase.setUp(self)
+        self.saved.update(dict([(name, getattr(solango.connection, name))
+                                for name in ('commit_policy', '_last_commit', 'cache')]))
+        solango.connection.monitor = FakeMonitor({'http://master:8983/solr/admin/ping': True})
+        solango.connection.cache = None
+
+    def tearDown(self):
+        solango.connection.flush_commit()
+        UpdateTestCase.tearDown(self)
+
+    def delete(self, policy):
+        solango.connection.commit_policy = policy
+        return solango.connection.delete_by_id(['blog__entry__1'])
+
+    def test_immediate(self):
+        res = self.delete(connection.COMMIT_IMMEDIATE)
+        self.failUnless(res[1])
+        self.assertEqual([body.strip() for body in self.sent[1:]], ['<commit/>'])
+
+    def test_within(self):
+        res = self.delete(connection.COMMIT_WITHIN)
+        self.assertEqual(res[1], None)
+        self.assertEqual(len(self.sent), 1)
+        self.failUnless('<delete commitWithin="1000">' in self.sent[0])
+
+    def test_explicit(self):
+        res = self.delete(connection.COMMIT_EXPLICIT)
+        self.assertEqual(res[1], None)
+        self.assertEqual(len(self.sent), 1)
+        self.failIf('commitWithin' in self.sent[0])
+
+    def test_interval(self):
+        solango.connection._last_commit = 0
+        self.failUnless(self.delete(connection.COMMIT_INTERVAL)[1])
+        self.assertEqual(len(self.sent), 2)
+
+        # Inside the interval the commit is postponed, and run at exit
+        self.assertEqual(self.delete(connection.COMMIT_INTERVAL)[1], None)
+        self.assertEqual(len(self.sent), 3)
+        self.failUnless(solango.connection.flush_commit())
+        self.assertEqual(self.sent[-1].strip(), '<commit/>')
+        self.assertEqual(solango.connection.flush_commit(), None)
+
+# The same select as XML and as JSON (json.nl=arrarr), see ParserTest
+PARSER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<response>
+<lst name="responseHeader"><int name="status">0</int><int name="QTime">2</int>
+<lst name="params"><str name="q">django</str><str name="rows">10</str><str name="start">0</str>
+<arr name="facet.field"><str>model</str><str>{!ex=category}category</str></arr>
+<arr name="facet.query"><str>price:[100 TO *]</str><str>price:[0 TO 100]</str></arr>
+<str name="facet.date">pub_date</str><str name="facet.range">price</str></lst></lst>
+<result name="response" numFound="2" start="0" maxScore="1.5">
+<doc><float name="score">1.5</float><str name="id">blog__entry__1</str><str name="model">blog__entry</str>
+<float name="rating">4.25</float><int name="site_id">1</int><arr name="text"><str>hello django</str></arr>
+<date name="pub_date">2008-05-01T00:00:00Z</date><bool name="featured">true</bool><long name="views">12345678901</long>
+<arr name="tags"><str>web</str><str>python</str></arr><arr name="dates"><date>2008-05-01T00:00:00Z</date></arr></doc>
+<doc><float name="score">0.5</float><str name="id">blog__entry__2</str><str name="model">blog__entry</str>
+<double name="rating">3.5</double><int name="site_id">1</int><bool name="featured">false</bool></doc>
+</result>
+<lst name="facet_counts">
+<lst name="facet_queries"><int name="price:[100 TO *]">1</int><int name="price:[0 TO 100]">4</int></lst>
+<lst name="facet_fields">
+<lst name="model"><int name="blog__entry">2</int><int name="blog__link">1</int></lst>
+<lst name="category"><int name="news">3</int><int name="news__national">1</int><int name="sports">1</int></lst>
+</lst>
+<lst name="facet_dates"><lst name="pub_date"><int name="2007-01-01T00:00:00Z">5</int><int name="2008-01-01T00:00:00Z">11</int>
+<str name="gap">+1YEAR</str><date name="start">2007-01-01T00:00:00Z</date><date name="end">2009-01-01T00:00:00Z</date>
+<int name="before">2</int></lst></lst>
+<lst name="facet_ranges"><lst name="price"><lst name="counts"><int name="0.0">3</int><int name="100.0">2</int></lst>
+<float name="gap">100.0</float><float name="start">0.0</float><float name="end">200.0</float></lst></lst>
+</lst>
+<lst name="highlighting"><lst name="blog__entry__1"><arr name="text"><str>hello &lt;em&gt;django&lt;/em&gt;</str></arr></lst>
+<lst name="blog__entry__2"/></lst>
+</response>"""
+
+PARSER_JSON = """{"responseHeader":{"status":0,"QTime":2,"params":{"q":"django","rows":"10","start":"0",
+"facet.field":["model","{!ex=category}category"],"facet.query":["price:[100 TO *]","price:[0 TO 100]"],
+"facet.date":"pub_date","facet.range":"price"}},
+"response":{"numFound":2,"start":0,"maxScore":1.5,"docs":[
+{"score":1.5,"id":"blog__entry__1","model":"blog__entry","rating":4.25,"site_id":1,"text":["hello django"],
+"pub_date":"2008-05-01T00:00:00Z","featured":true,"views":12345678901,"tags":["web","python"],
+"dates":["2008-05-01T00:00:00Z"]},
+{"score":0.5,"id":"blog__entry__2","model":"blog__entry","rating":3.5,"site_id":1,"featured":false}]},
+"facet_counts":{"facet_queries":{"price:[0 TO 100]":4,"price:[100 TO *]":1},
+"facet_fields":{"category":[["news",3],["news__national",1],["sports",1]],"model":[["blog__entry",2],["blog__link",1]]},
+"facet_dates":{"pub_date":{"2008-01-01T00:00:00Z":11,"2007-01-01T00:00:00Z":5,"gap":"+1YEAR",
+"start":"2007-01-01T00:00:00Z","end":"2009-01-01T00:00:00Z","before":2}},
+"facet_ranges":{"price":{"counts":[["0.0",3],["100.0",2]],"gap":100.0,"start":0.0,"end":200.0}}},
+"highlighting":{"blog__entry__1":{"text":["hello <em>django</em>"]},"blog__entry__2":{}}}"""
+
+def describe(res):
+    """
+    Returns everything a SelectResults parsed, as plain values to compare.
+    """
+    return {
+        'count': res.count,
+        'documents': [res.documents.raw(i) for i in range(len(res.documents))],
+        'facets': [(f.name, [(v.value, v.count, v.level) for v in f.values]) for f in res.facets],
+        'facet_queries': [(f.query, f.count) for f in res.facet_queries],
+        'facet_dates': [(f.name, f.gap, f.start, f.end, f.before,
+                         [(v.start, v.end, v.count) for v in f.values]) for f in res.facet_dates],
+        'facet_ranges': [(f.name, f.gap, f.start, f.end,
+                          [(v.start, v.end, v.count) for v in f.values]) for f in res.facet_ranges],
+        'highlighting': res.highlighting,
+    }
+
+class ParserTest(unittest.TestCase):
+
+    def get_results(self):
+        return (results.SelectResults(PARSER_XML),
+                results.JSONSelectResults(PARSER_JSON),
+                results.StreamingSelectResults(PARSER_XML),
+                results.StreamingSelectResults(StringIO(PARSER_XML)))
+
+    def test_parsers_match(self):
+        xml = describe(results.SelectResults(PARSER_XML))
+        for res in self.get_results()[1:]:
+            other = describe(res)
+            for key in xml.keys():
+                self.assertEqual(other[key], xml[key], "%s: %s" % (res.__class__.__name__, key))
+
+    def test_facet_order(self):
+        for res in self.get_results():
+            self.assertEqual([f.name for f in res.facets], ['model', 'category'])
+            self.assertEqual([f.query for f in res.facet_queries], ['price:[100 TO *]', 'price:[0 TO 100]'])
+
+    def test_typed_fields(self):
+        for res in self.get_results():
+            (first, second) = (res.documents.raw(0), res.documents.raw(1))
+            self.assertEqual((first['score'], first['rating']), (1.5, 4.25))
+            self.assertEqual((second['score'], second['rating']), (0.5, 3.5))
+            self.assertEqual((first['featured'], second['featured']), (True, False))
+            self.assertEqual(first['views'], 12345678901)
+            self.assertEqual(first['dates'], [u'2008-05-01T00:00:00Z'])
+
+    def test_query_facets(self):
+        for res in self.get_results():
+            self.assertEqual([(f.query, f.count) for f in res.facet_queries],
+                             [(u'price:[100 TO *]', 1), (u'price:[0 TO 100]', 4)])
+            self.assertEqual(res.facet_queries[0].value, u'price:[100 TO *]')
+
+    def test_date_facets(self):
+        for res in self.get_results():
+            (facet,) = res.facet_dates
+            self.assertEqual((facet.name, facet.gap, facet.before, facet.after), (u'pub_date', u'+1YEAR', 2, None))
+            self.assertEqual((facet.start, facet.end), (datetime(2007, 1, 1), datetime(2009, 1, 1)))
+            self.assertEqual([(v.value, v.start, v.end, v.count) for v in facet.values],
+                             [(u'2007-01-01T00:00:00Z', datetime(2007, 1, 1), datetime(2008, 1, 1), 5),
+                              (u'2008-01-01T00:00:00Z', datetime(2008, 1, 1), datetime(2009, 1, 1), 11)])
+
+    def test_range_facets(self):
+        for res in self.get_results():
+            (facet,) = res.facet_ranges
+            self.assertEqual((facet.name, facet.gap, facet.start, facet.end), (u'price', 100.0, 0.0, 200.0))
+            self.assertEqual([(v.value, v.start, v.end, v.count) for v in facet.values],
+                             [(u'0.0', 0.0, 100.0, 3), (u'100.0', 100.0, 200.0, 2)])
+
+class PendingDocument(object):
+    """
+    Just enough of a SearchDocument for the BufferedWriter.
+    """
+    def __init__(self, id):
+        self.pk_field = solango.fields.PrimaryKeyField()
+        self.pk_field.value = id
+
+class WriterConnection(object):
+    """
+    Records the batches a BufferedWriter sends, failing while up is False.
+    """
+    def __init__(self):
+        (self.up, self.batches) = (True, [])
+
+    def add(self, documents):
+        self.batches.append(('add', [d.pk_field.value for d in documents]))
+        if not self.up:
+            raise IOError("Solr is down")
+        return [True, None]
+
+    def delete_by_id(self, ids):
+        self.batches.append(('delete', list(ids)))
+        return self.up and [True, None] or None
+
+class BufferedWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = WriterConnection()
+        self.writer = BufferedWriter(self.connection, size=10)
+
+    def test_coalescing(self):
+        self.writer.add(PendingDocument('blog__entry__1'))
+        self.writer.add(PendingDocument('blog__entry__2'))
+        self.writer.add(PendingDocument('blog__entry__1'))
+        self.writer.delete('blog__entry__2')
+        self.assertEqual(self.writer.pending, 2)
+        self.assertEqual(self.writer.flush(), 2)
+        self.assertEqual(self.connection.batches, [('add', ['blog__entry__1']),
+                                                   ('delete', ['blog__entry__2'])])
+        stats = self.writer.stats
+        self.assertEqual((stats['coalesced'], stats['added'], stats['deleted']), (2, 1, 1))
+
+    def test_size_flushes(self):
+        writer = BufferedWriter(self.connection, size=2)
+        writer.add(PendingDocument('blog__entry__1'))
+        self.assertEqual(self.connection.batches, [])
+        writer.add(PendingDocument('blog__entry__2'))
+        self.assertEqual(self.connection.batches, [('add', ['blog__entry__1', 'blog__entry__2'])])
+        self.assertEqual(writer.pending, 0)
+
+    def test_failed_batch_requeued(self):
+        self.connection.up = False
+        self.writer.add(PendingDocument('blog__entry__1'))
+        self.writer.delete('blog__entry__2')
+        self.assertEqual(self.writer.flush(), 0)
+        self.assertEqual(self.writer.pending, 2)
+        self.assertEqual(self.writer.stats['failed'], 2)
+
+        # A change queued since the failure wins over the failed one
+        self.writer.add(PendingDocument('blog__entry__2'))
+        self.writer.add(PendingDocument('blog__entry__3'))
+        self.connection.up = True
+        self.connection.batches = []
+        self.assertEqual(self.writer.flush(), 3)
+        self.assertEqual(self.connection.batches,
+                         [('add', ['blog__entry__1', 'blog__entry__2', 'blog__entry__3'])])
+        self.assertEqual(self.writer.pending, 0)
+
+    def test_buffered_discards_on_error(self):
+        def save():
+            self.writer.add(PendingDocument('blog__entry__1'))
+            raise ValueError
+        self.assertRaises(ValueError, self.writer.buffered(save))
+        self.assertEqual((self.writer.pending, self.connection.batches), (0, []))
+
+    def test_commit_on_success(self):
+        def save():
+            self.writer.add(PendingDocument('blog__entry__1'))
+        self.writer.commit_on_success(save)()
+        self.assertEqual(self.connection.batches, [('add', ['blog__entry__1'])])
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = cache.LocalResultCache(results.SelectResults, size=2)
+
+    def test_normalize(self):
+        self.assertEqual(cache.normalize('q=a&facet.field=model&facet.field=category&fl=id'),
+                         cache.normalize('fl=id&facet.field=model&q=a&facet.field=category'))
+        self.assertNotEqual(cache.normalize('facet.field=model&facet.field=category'),
+                            cache.normalize('facet.field=category&facet.field=model'))
+
+    def test_hits_are_not_shared(self):
+        self.assertEqual(self.cache.get('q=django'), None)
+        self.cache.set('q=django', PARSER_XML)
+        (first, second) = (self.cache.get('q=django'), self.cache.get('q=django'))
+        self.failIf(first is second)
+        self.failIf(first.documents is second.documents)
+        self.assertEqual(describe(first), describe(second))
+        stats = self.cache.stats
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+
+    def test_eviction(self):
+        for q in ('a', 'b', 'c'):
+            self.cache.set('q=%s' % q, PARSER_XML)
+        self.assertEqual(self.cache.get('q=a'), None)
+        self.failUnless(self.cache.get('q=c'))
+        self.assertEqual(self.cache.stats['evictions'], 1)
+        self.cache.clear()
+        self.assertEqual(self.cache.get('q=c'), None)
+
+class FilterTest(unittest.TestCase):
+
+    def get_params(self, query):
+        params = {}
+        for key, value in cgi.parse_qsl(query.url):
+            params.setdefault(key, []).append(value)
+        return params
+
+    def test_multiselect(self):
+        query = Query({'q': 'django', 'category': 'news', 'facet.field': 'category'})
+        params = self.get_params(query)
+        self.assertEqual(params['fq'], ['{!tag=category}category:news'])
+        self.assertEqual(params['facet.field'], ['model', '{!ex=category}category'])
+        self.assertEqual(params['q'], ['django'])
+
+    def test_filter_field(self):
+        query = Query({'q': 'django', 'model': ['blog__entry', 'blog__link']})
+        self.assertEqual(self.get_params(query)['fq'], ['{!tag=model}(model:blog__entry OR model:blog__link)'])
+
+    def test_escaping(self):
+        query = Query({'q': 'django', 'category': 'a} OR *:* {b', 'facet.field': 'category',
+                       'author': 'joe "x" (y)'})
+        params = self.get_params(query)
+        self.assertEqual(params['q'], [r'django AND author:joe\ \"x\"\ \(y\)'])
+        self.assertEqual(params['fq'], [r'{!tag=category}category:a\}\ OR\ \*\:\*\ \{b'])
+
+    def test_default_filter_fields(self):
+        from solango import initial_settings
+        from solango.solr import query
+        self.assertEqual(query.DEFAULT_FILTER_FIELDS, initial_settings.SEARCH_FILTER_FIELDS)
+
+    def test_invalid_key(self):
+        query = Query({'q': 'django', 'x}model:*{!a': 'b', 'fq}': 'c'})
+        self.assertEqual((query.q, query.fq), (['django'], []))
+
+HYDRATE_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<response>
+<lst name="responseHeader"><int name="status">0</int><int name="QTime">1</int>
+<lst name="params"><str name="rows">10</str><str name="start">0</str></lst></lst>
+<result name="response" numFound="4" start="0">
+<doc><str name="id">blog__entry__3</str><str name="model">blog__entry</str></doc>
+<doc><str name="id">blog__link__1</str><str name="model">blog__link</str></doc>
+<doc><str name="id">blog__entry__9</str><str name="model">blog__entry</str></doc>
+<doc><str name="id">blog__entry__1</str><str name="model">blog__entry</str></doc>
+</result>
+</response>"""
+
+class Instance(object):
+    def __init__(self, model_key, pk):
+        (self.model_key, self.pk) = (model_key, pk)
+
+class InstanceQuerySet(object):
+    """
+    A manager returning instances for existing primary keys, in reverse
+    order, and recording the queries made.
+    """
+    def __init__(self, model_key, existing, log):
+        (self.model_key, self.existing, self.log) = (model_key, existing, log)
+
+    def filter(self, pk__in):
+        self.log.append((self.model_key, 'filter', sorted(pk__in)))
+        return [Instance(self.model_key, pk) for pk in sorted(pk__in, reverse=True)
+                if pk in self.existing]
+
+class InstanceModel(object):
+    def __init__(self, manager):
+        self._default_manager = manager
+
+class HydrateTest(unittest.TestCase):
+
+    def setUp(self):
+        import solango.solr
+        self.saved = (solango.registry.copy(), solango.solr.get_model_from_key)
+        self.log = []
+        models = {
+            'blog__entry': InstanceModel(InstanceQuerySet('blog__entry', ['1', '3'], self.log)),
+            'blog__link': InstanceModel(InstanceQuerySet('blog__link', ['1'], self.log)),
+        }
+        solango.registry.update({'blog__entry': ListingDocument, 'blog__link': ListingDocument})
+        solango.solr.get_model_from_key = models.get
+
+    def tearDown(self):
+        import solango.solr
+        solango.registry.clear()
+        solango.registry.update(self.saved[0])
+        solango.solr.get_model_from_key = self.saved[1]
+
+    def test_result_order(self):
+        documents = results.SelectResults(HYDRATE_RESPONSE).documents
+        instances = documents.hydrate()
+        self.assertEqual([(i.model_key, i.pk) for i in instances],
+                         [('blog__entry', '3'), ('blog__link', '1'), ('blog__entry', '1')])
+        # One query per model
+        self.assertEqual(self.log, [('blog__entry', 'filter', ['1', '3', '9']),
+                                    ('blog__link', 'filter', ['1'])])
+
+    def test_cached(self):
+        documents = results.SelectResults(HYDRATE_RESPONSE).documents
+        cached = Instance('blog__link', 'cached')
+        instances = documents.hydrate({'blog__link__1': cached})
+        self.failUnless(instances[1] is cached)
+        self.assertEqual(len(instances), 3)
+        self.assertEqual([model_key for (model_key, method, pks) in self.log], ['blog__entry'])
+
+class PagedResults(object):
+    (facets, documents, next_cursor_mark) = ([], [], None)
+
+    def __init__(self, count):
+        self.count = count
+
+class Request(object):
+    def __init__(self, **params):
+        (self.path, self.GET) = ('/search/', params)
+
+class Settings(object):
+    pass
+
+class PaginatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = paginator.settings
+        paginator.settings = Settings()
+        (self.selects, self.count) = ([], 100)
+        def select(params):
+            query = isinstance(params, Query) and params or Query(params)
+            self.selects.append(query)
+            res = PagedResults(self.count)
+            if query.cursorMark:
+                res.next_cursor_mark = 'mark%d' % len(self.selects)
+            return res
+        solango.connection.select = select
+
+    def tearDown(self):
+        paginator.settings = self.saved
+        del solango.connection.select
+
+    def paginate(self, **params):
+        return paginator.SearchPaginator(dict(params, q='django'), Request(**params))
+
+    def get_links(self, pages):
+        return [isinstance(link, dict) and link['anchor'] or link for link in pages.links]
+
+    def test_page_range(self):
+        self.assertEqual(self.get_links(self.paginate(page='1')), ['1', '2', '3', '...', '20'])
+        self.assertEqual(self.get_links(self.paginate(page='10')),
+                         ['1', '...', '8', '9', '10', '11', '12', '...', '20'])
+        # A single hidden page is shown instead of ...
+        self.assertEqual(self.get_links(self.paginate(page='4')), ['1', '2', '3', '4', '5', '6', '...', '20'])
+        self.assertEqual(self.get_links(self.paginate(page='20')), ['1', '...', '18', '19', '20'])
+
+    def test_page_range_size(self):
+        self.count = 10 ** 9
+        pages = self.paginate(page='1000')
+        self.assertEqual(len(pages.page_range()), 9)
+        self.assertEqual(pages.page_range()[-1], 2 * 10 ** 8)
+
+    def test_max_offset(self):
+        paginator.settings.SEARCH_PAGINATOR_MAX_OFFSET = 20
+        self.assertEqual(self.get_links(self.paginate(page='3')), ['1', '2', '3', '4', '5'])
+        pages = self.paginate(page='5')
+        self.assertEqual(pages.next_link, None)
+        self.assertRaises(InvalidPage, self.paginate, page='6')
+        self.assertRaises(InvalidPage, self.paginate, page='x')
+
+    def test_cursor_seek(self):
+        paginator.settings.SEARCH_PAGINATOR_MAX_OFFSET = 20
+        paginator.settings.SEARCH_PAGINATOR_DEEP_PAGING = paginator.CURSOR
+
+        # Rendering the last offset page costs a single select
+        pages = self.paginate(page='5')
+        self.assertEqual(len(self.selects), 1)
+        self.assertEqual(pages.next_link, '/search/?page=6&seek=25')
+
+        # Following the link seeks the cursor, then selects the page with it
+        self.selects = []
+        pages = self.paginate(page='6', seek='25')
+        (seek, select) = self.selects
+        self.assertEqual((seek.rows, seek.cursorMark), (25, '*'))
+        self.assertEqual((select.start, select.cursorMark), (0, 'mark1'))
+        self.assertEqual(pages.previous_link, '/search/?page=5')
+        self.assertEqual(pages.next_link, '/search/?page=7&cursor=mark2&trail=mark1')
+
+    def test_seek_refused(self):
+        paginator.settings.SEARCH_PAGINATOR_MAX_OFFSET = 20
+        for seek in ('20', '30', 'x'):
+            self.assertRaises(InvalidPage, self.paginate, page='6', seek=seek)
+        self.assertRaises(InvalidPage, self.paginate, page='7', seek='30')
+        paginator.settings.SEARCH_PAGINATOR_DEEP_PAGING = paginator.CURSOR
+        self.assertRaises(InvalidPage, self.paginate, page='7', seek='30')
+        self.assertEqual(self.selects, [])
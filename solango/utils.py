@@ -74,6 +74,11 @@ def get_facets_links(request, results):
     """
     Returns a list of facet links, allowing users to quickly drill into their
     search results by fields which support faceting.
+    
+    Filters on faceted fields are excluded from their own facet (see
+    Query.add_filter), so the counts of a facet the user already picked a
+    value from are those of the other values, and one response is enough
+    to build the whole navigation.
     """
     (links, link) = ([], {})
     
@@ -83,14 +88,15 @@ def get_facets_links(request, results):
         
         base = get_base_url(request, ["page", facet.name])
         
+        val = get_param(request, facet.name, None)
+        
         link = {
-            "anchor": "All", "count": None, "level": "0", "href": base
+            "anchor": "All", "count": None, "level": "0", "href": base,
+            "active": val is None
         }
         
         links.append(link)
         
-        val = get_param(request, facet.name, None)
-        
         for value in facet.values:
             clean = value.value
             if clean.find(" ") is not -1:
@@ -98,7 +104,7 @@ def get_facets_links(request, results):
             
             link = {
                 "anchor": value.name, "count": value.count, "level": value.level,
-                "href": base + facet.name + "=" + clean + ""
+                "href": base + urllib.urlencode({facet.name: clean.encode('utf-8')})
             }
             
             if val == clean:
@@ -137,15 +143,25 @@ def create_schema_xml(raw=False):
         return render_to_string('solango/schema.xml', {'fields': doc, "copy_fields"  : copy_doc })
 
 
-def reindex():
+def reindex(workers=1, batch_size=100, progress=None):
     """
-    Reindexes all of the models registered to solango
+    Reindexes all of the models registered to solango. See solango.indexing.
     """
-    import solango
-    from solango.solr import get_model_from_key
-    
-    for model_key, document in solango.registry.items():
-        model = get_model_from_key(model_key)
-        for instance in model.objects.all():
-            doc = document(instance)
-            solango.connection.add(doc)
\ No newline at end of file
+    from solango import indexing
+    return indexing.reindex(workers, batch_size, progress)
+
+def reindex_sharded(processes=2, batch_size=100, retries=2, progress=None):
+    """
+    Reindexes all of the models registered to solango in a pool of processes.
+    See solango.indexing.
+    """
+    from solango import indexing
+    return indexing.reindex_sharded(processes, batch_size, retries, progress)
+
+def reindex_incremental(batch_size=100, progress=None):
+    """
+    Reindexes the objects changed since the last incremental run.  See
+    solango.indexing.
+    """
+    from solango import indexing
+    return indexing.reindex_incremental(batch_size, progress)
\ No newline at end of file
@@ -4,7 +4,8 @@
 
 from django.shortcuts import render_to_response
 from django.template import RequestContext
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, Http404
+from django.core.paginator import InvalidPage
 from django.core.urlresolvers import reverse
 
 from solango import connection
@@ -33,7 +34,10 @@ def select(request, q=''):
         params.update(dict(request.GET.items()))
     
     if params:
-        paginator = SearchPaginator(params, request)
+        try:
+            paginator = SearchPaginator(params, request)
+        except InvalidPage:
+            raise Http404
         facets = utils.get_facets_links( request, paginator.results)
         sort_links = utils.get_sort_links(request)
         